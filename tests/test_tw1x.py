@@ -6,6 +6,8 @@ Run with: python3 -m pytest test_tw1x.py -v
 Or: python3 test_tw1x.py
 """
 
+import os
+import tempfile
 import unittest
 from tw1x import (
     TweeParser, parse_twee, Passage, Link, ParseResult,
@@ -13,12 +15,24 @@ from tw1x import (
 )
 
 
+TEST_FILE_STORY = """:: StoryInit
+<<set $HERO to "Åsa">>
+
+:: Start [intro]
+Hello <<print $HERO>> [[Next]]
+
+:: Next
+The end.
+"""
+
+
 class TestCoreParser(unittest.TestCase):
     """Test core passage parsing functionality."""
 
-    def setUp(self):
-        """Create parser instance for tests."""
-        self.parser = TweeParser()
+    @classmethod
+    def setUpClass(cls):
+        """Create one parser instance shared by the tests."""
+        cls.parser = TweeParser()
 
     def test_simple_passage(self):
         """Test parsing a simple passage."""
@@ -34,6 +48,56 @@ This is the start passage.
         self.assertEqual(result.passages['Start'].content, 'This is the start passage.')
         self.assertEqual(result.passages['Start'].tags, [])
 
+    def test_passage_names(self):
+        """Test passage_names mirrors the parsed passage dict."""
+        result = self.parser.parse_twee(":: Start\nHi\n\n:: End\nBye\n")
+
+        self.assertEqual(result.passage_names, frozenset(['Start', 'End']))
+        self.assertIn('End', result.passage_names)
+
+    def test_parse_twee_file(self):
+        """Test parsing from a file matches parsing the same text."""
+        for content in (TEST_FILE_STORY, TEST_FILE_STORY.replace('\n', '\r\n'), ''):
+            with tempfile.NamedTemporaryFile('wb', suffix='.twee', delete=False) as f:
+                f.write(content.encode('utf-8'))
+            try:
+                from_file = self.parser.parse_twee_file(f.name)
+            finally:
+                os.unlink(f.name)
+
+            expected = self.parser.parse_twee(content.replace('\r\n', '\n'))
+            self.assertEqual(from_file.passages, expected.passages)
+            self.assertEqual(from_file.story_init_vars, expected.story_init_vars)
+
+    def test_raw_content_shares_content_string(self):
+        """Test passages without images keep one copy of their body text."""
+        result = self.parser.parse_twee(":: Start\nSome text\n\n:: Next\nMore\n")
+
+        for passage in result.passages.values():
+            self.assertIs(passage.raw_content, passage.content)
+
+    def test_reparse_builds_independent_passages(self):
+        """Test reparsing the same text never shares mutable passage state."""
+        content = ":: Start [a, b]\nSome text\n"
+        first = self.parser.parse_twee(content).passages['Start']
+        second = self.parser.parse_twee(content).passages['Start']
+
+        self.assertIsNot(first, second)
+        first.tags.append('c')
+        first.content = "Changed"
+        self.assertEqual(second.tags, ['a', 'b'])
+        self.assertEqual(second.content, "Some text")
+
+    def test_clear_cache_releases_passage_text(self):
+        """Test clear_cache empties the section cache without changing results."""
+        content = ":: Start [a]\nSome text\n"
+        before = self.parser.parse_twee(content).passages['Start']
+        TweeParser.clear_cache()
+        self.assertEqual(TweeParser._passage_fields.cache_info().currsize, 0)
+
+        after = self.parser.parse_twee(content).passages['Start']
+        self.assertEqual(after, before)
+
     def test_passage_with_tags(self):
         """Test parsing passage with tags."""
         content = """
@@ -86,6 +150,23 @@ Content.
         self.assertIn('Start', result.passages)
         self.assertEqual(result.passages['Start'].name, 'Start')
 
+    def test_first_passage_with_leading_whitespace(self):
+        """Test an indented first header still starts a passage; other leading text does not."""
+        for content in ('  :: Start\nHi\n:: Next\nB\n', '\u00a0:: Start\nHi\n:: Next\nB\n'):
+            result = self.parser.parse_twee(content)
+            self.assertEqual(sorted(result.passages), ['Next', 'Start'])
+            self.assertEqual(result.passages['Start'].content, 'Hi')
+
+            with tempfile.NamedTemporaryFile('wb', suffix='.twee', delete=False) as f:
+                f.write(content.encode('utf-8'))
+            try:
+                self.assertEqual(self.parser.parse_twee_file(f.name).passages, result.passages)
+            finally:
+                os.unlink(f.name)
+
+        result = self.parser.parse_twee('Notes :: Start\n:: Next\nB\n')
+        self.assertEqual(list(result.passages), ['Next'])
+
     def test_multiline_content(self):
         """Test passage with multiline content."""
         content = """
@@ -105,9 +186,10 @@ Line three.
 class TestLinkExtraction(unittest.TestCase):
     """Test link parsing from passages."""
 
-    def setUp(self):
-        """Create parser instance for tests."""
-        self.parser = TweeParser()
+    @classmethod
+    def setUpClass(cls):
+        """Create one parser instance shared by the tests."""
+        cls.parser = TweeParser()
 
     def test_simple_link(self):
         """Test [[Target]] syntax."""
@@ -166,13 +248,39 @@ Go [[ACCEPT_QUEST]] or [[ASK_INFO]]
         self.assertEqual(links[0].target, 'ACCEPT_QUEST')
         self.assertEqual(links[1].target, 'ASK_INFO')
 
+    def test_links_cached_until_content_changes(self):
+        """Test link scan is cached on the passage and refreshed on edit."""
+        result = self.parser.parse_twee(":: Start\nGo [[North]]\n")
+        passage = result.passages['Start']
+
+        self.assertIs(passage.links, passage.links)
+
+        # Callers get their own copy, down to each link's setters
+        self.parser.extract_links(passage).clear()
+        self.assertEqual(len(passage.links), 1)
+        self.parser.extract_links(passage)[0].setters.append(('$GOLD', '=', '1'))
+        self.assertEqual(passage.links[0].setters, [])
+
+        passage.content = "Go [[South]] or [[West]]"
+        self.assertEqual([l.target for l in passage.links], ['South', 'West'])
+
+    def test_link_targets_share_passage_names(self):
+        """Test link targets are the interned passage name strings."""
+        result = self.parser.parse_twee(":: Start\n[[Go|Next_Room]] [[Next_Room]]\n\n:: Next_Room\nHi\n")
+        name = next(n for n in result.passages if n == 'Next_Room')
+        links = self.parser.extract_links(result.passages['Start'])
+
+        self.assertIs(links[0].target, name)
+        self.assertIs(links[1].target, name)
+
 
 class TestImageExtraction(unittest.TestCase):
     """Test image URL extraction."""
 
-    def setUp(self):
-        """Create parser instance for tests."""
-        self.parser = TweeParser()
+    @classmethod
+    def setUpClass(cls):
+        """Create one parser instance shared by the tests."""
+        cls.parser = TweeParser()
 
     def test_image_url(self):
         """Test [img[url]] syntax."""
@@ -201,9 +309,10 @@ Just text here.
 class TestSpecialPassages(unittest.TestCase):
     """Test special passage handling."""
 
-    def setUp(self):
-        """Create parser instance for tests."""
-        self.parser = TweeParser()
+    @classmethod
+    def setUpClass(cls):
+        """Create one parser instance shared by the tests."""
+        cls.parser = TweeParser()
 
     def test_story_title(self):
         """Test StoryTitle passage."""
@@ -295,22 +404,34 @@ class TestErrorHandling(unittest.TestCase):
 
         self.assertEqual(len(result.passages), 0)
 
+    def test_errors_do_not_leak_between_parses(self):
+        """Test a reused parser reports only the current parse's errors."""
+        parser = TweeParser()
+
+        bad = parser.parse_twee("::[tag]\nNo name\n")
+        good = parser.parse_twee(":: Start\nFine\n")
+
+        self.assertEqual(len(bad.errors), 1)
+        self.assertEqual(good.errors, [])
+        self.assertEqual(parser.errors, [])
+
 
 class TestBarbarianStory(unittest.TestCase):
     """Integration test with real story file."""
 
-    def test_barbarian_story_structure(self):
-        """Test parsing the actual barbarian story."""
-        import os
+    story_path = 'engine/games/barbarian/data/story.twee'
 
-        story_path = 'engine/games/barbarian/data/story.twee'
-        if not os.path.exists(story_path):
-            self.skipTest("Barbarian story file not found")
+    @classmethod
+    def setUpClass(cls):
+        """Parse the story once for every test in the class."""
+        if not os.path.exists(cls.story_path):
+            raise unittest.SkipTest("Barbarian story file not found")
 
-        with open(story_path, 'r') as f:
-            content = f.read()
+        cls._result = TweeParser().parse_twee_file(cls.story_path)
 
-        result = parse_twee(content)
+    def test_barbarian_story_structure(self):
+        """Test parsing the actual barbarian story."""
+        result = self._result
 
         # Verify expected passages exist
         self.assertIn('StoryTitle', result.passages)
@@ -364,6 +485,18 @@ class TestDataStructures(unittest.TestCase):
         repr_str = repr(result)
         self.assertIn('1 passages', repr_str)
 
+    def test_passage_to_dict(self):
+        """Test Passage.to_dict includes links as plain dicts."""
+        passage = Passage('Start', ['tag1'], 'Go [[Next]]', 'Go [[Next]]')
+
+        self.assertEqual(passage.to_dict(), {
+            'name': 'Start',
+            'tags': ['tag1'],
+            'content': 'Go [[Next]]',
+            'image_url': None,
+            'links': [{'display': 'Next', 'target': 'Next', 'setters': []}]
+        })
+
 
 # ============================================================================
 # Main - Run tests
@@ -2,29 +2,81 @@
 """
 CLI integration tests for TW1X
 
-Tests the tw1x_cli.py command-line interface.
+Tests the tw1x_cli.py command-line interface. Commands run in-process
+through tw1x_cli.main(); one smoke test still spawns the script.
 
 Run with: python3 test_tw1x_cli.py
 """
 
 import unittest
+import argparse
+import functools
 import subprocess
+import io
 import json
 import os
 import shlex
+import sys
+import tempfile
 from pathlib import Path
+from unittest import mock
+
+from tw1x import tw1x_cli, parse_twee
+
+
+CLI_SCRIPT = Path(tw1x_cli.__file__)
+TEST_STORY = 'engine/games/barbarian/data/story.twee'
+
+
+@functools.lru_cache(maxsize=None)
+def preparsed_test_story() -> dict:
+    """
+    Parse the Barbarian story once for every test class that uses it.
+
+    Returns:
+        {TEST_STORY: ParseResult}, to pass to run_cli as preparsed
+
+    Raises:
+        unittest.SkipTest: If the story file is not present
+    """
+    if not os.path.exists(TEST_STORY):
+        raise unittest.SkipTest("Barbarian story file not found")
+
+    with open(TEST_STORY, 'r') as f:
+        return {TEST_STORY: parse_twee(f.read())}
+
+
+def run_cli(command: str, stdin_data: str = None, preparsed: dict = None) -> str:
+    """
+    Run a CLI command in-process and return its raw stdout.
+
+    Args:
+        command: CLI command line (without the program name)
+        stdin_data: Optional data to pass on stdin
+        preparsed: Optional already parsed stories keyed by file path
+
+    Returns:
+        Captured output
+    """
+    buf = io.StringIO()
+    tw1x_cli.main(
+        shlex.split(command),
+        stdin=io.StringIO(stdin_data or ''),
+        stdout=buf,
+        preparsed=preparsed
+    )
+    return buf.getvalue()
 
 
 class TestCLICommands(unittest.TestCase):
     """Test CLI commands."""
 
-    def setUp(self):
-        """Set up test environment."""
-        self.cli = 'python3 tw1x_cli.py'
-        self.test_story = 'engine/games/barbarian/data/story.twee'
+    test_story = TEST_STORY
 
-        if not os.path.exists(self.test_story):
-            self.skipTest("Barbarian story file not found")
+    @classmethod
+    def setUpClass(cls):
+        """Share the once-parsed story with every test in the class."""
+        cls._preparsed = preparsed_test_story()
 
     def _run_cli(self, command: str, stdin_data: str = None) -> dict:
         """
@@ -37,20 +89,13 @@ class TestCLICommands(unittest.TestCase):
         Returns:
             Parsed JSON output
         """
-        # Split command for subprocess to avoid shell expansion
-        cmd_parts = ['python3', 'tw1x_cli.py'] + shlex.split(command)
-        result = subprocess.run(
-            cmd_parts,
-            input=stdin_data,
-            capture_output=True,
-            text=True
-        )
+        output = run_cli(command, stdin_data, self._preparsed)
 
         # Parse JSON output
         try:
-            return json.loads(result.stdout)
+            return json.loads(output)
         except json.JSONDecodeError:
-            self.fail(f"Invalid JSON output:\n{result.stdout}\nStderr:\n{result.stderr}")
+            self.fail(f"Invalid JSON output:\n{output}")
 
     def test_info_command(self):
         """Test info command."""
@@ -169,24 +214,14 @@ class TestCLICommands(unittest.TestCase):
 class TestCLIVariableHandling(unittest.TestCase):
     """Test CLI variable handling via stdin."""
 
-    def setUp(self):
-        """Set up test environment."""
-        self.cli = 'python3 tw1x_cli.py'
-
     def _run_cli(self, command: str, stdin_data: str = None) -> dict:
         """Run CLI command and return JSON output."""
-        cmd_parts = ['python3', 'tw1x_cli.py'] + shlex.split(command)
-        result = subprocess.run(
-            cmd_parts,
-            input=stdin_data,
-            capture_output=True,
-            text=True
-        )
+        output = run_cli(command, stdin_data)
 
         try:
-            return json.loads(result.stdout)
+            return json.loads(output)
         except json.JSONDecodeError:
-            self.fail(f"Invalid JSON output:\n{result.stdout}\nStderr:\n{result.stderr}")
+            self.fail(f"Invalid JSON output:\n{output}")
 
     def test_evaluate_empty_stdin(self):
         """Test evaluate with no stdin (empty variables)."""
@@ -194,6 +229,49 @@ class TestCLIVariableHandling(unittest.TestCase):
 
         self.assertEqual(output['result'], 42)
 
+    def test_pretty_output(self):
+        """Test --pretty indents the JSON; the default stays compact."""
+        compact = run_cli('evaluate "1 + 1"')
+        pretty = run_cli('--pretty evaluate "1 + 1"')
+
+        self.assertEqual(compact.count('\n'), 1)
+        self.assertIn('\n  "result": 2', pretty)
+        self.assertEqual(json.loads(pretty), json.loads(compact))
+
+    def test_render_rejects_story_on_stdin(self):
+        """Test render refuses '-' since stdin already carries the variables."""
+        output = self._run_cli(
+            'render - Start',
+            stdin_data=':: Start\nHello\n'
+        )
+
+        self.assertIn('error', output)
+        self.assertIn('stdin', output['error'])
+
+    def test_command_without_encoder_attribute(self):
+        """Test commands called with a bare Namespace still report errors as JSON."""
+        stdout = io.StringIO()
+        args = argparse.Namespace(file='/nonexistent/file.twee', passage='Start')
+        self.assertEqual(tw1x_cli.cmd_render(args, io.StringIO('{}'), stdout), 1)
+        self.assertIn('File not found', json.loads(stdout.getvalue())['error'])
+
+    def test_non_ascii_story_on_ascii_stdout(self):
+        """Test non-ASCII passages are escaped, so an ASCII stdout still works."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'story.twee')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(':: Start\nSk\u00e5l, Thorgrim! [[Next]]\n\n:: Next\nBye\n')
+
+            result = subprocess.run(
+                [sys.executable, str(CLI_SCRIPT), 'parse', path],
+                capture_output=True,
+                env=dict(os.environ, PYTHONIOENCODING='ascii')
+            )
+
+        self.assertEqual(result.returncode, 0, result.stdout)
+        output = json.loads(result.stdout)
+        self.assertEqual(output['passages']['Start']['content'], 'Sk\u00e5l, Thorgrim! [[Next]]')
+
     def test_evaluate_with_variables(self):
         """Test evaluate with variables from stdin."""
         variables = {'A': 10, 'B': 20}
@@ -219,37 +297,145 @@ class TestCLIVariableHandling(unittest.TestCase):
         self.assertIn('errors', output)
 
 
+class TestCLIStoryCache(unittest.TestCase):
+    """Test that story files are parsed once per process until they change."""
+
+    def test_parse_cached_until_file_changes(self):
+        """Test repeated commands reuse the parse; editing the file invalidates it."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'story.twee')
+            with open(path, 'w') as f:
+                f.write(':: Start\nHello [[Next]]\n\n:: Next\nBye\n')
+
+            tw1x_cli._parse_story_file.cache_clear()
+            first = tw1x_cli.load_story(argparse.Namespace(file=path), io.StringIO(), io.StringIO())
+            second = tw1x_cli.load_story(argparse.Namespace(file=path), io.StringIO(), io.StringIO())
+            self.assertEqual(tw1x_cli._parse_story_file.cache_info().hits, 1)
+            self.assertEqual(second.passages, first.passages)
+
+            with open(path, 'w') as f:
+                f.write(':: Start\nChanged\n')
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+            output = json.loads(run_cli(f'parse {path}'))
+            self.assertEqual(output['passage_count'], 1)
+
+    def test_cached_parse_not_shared_between_calls(self):
+        """Test mutating a loaded story does not leak into later loads."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'story.twee')
+            with open(path, 'w') as f:
+                f.write(':: StoryInit\n<<set $HP to 10>>\n\n:: Start [intro]\nHello\n')
+
+            args = argparse.Namespace(file=path)
+            first = tw1x_cli.load_story(args, io.StringIO(), io.StringIO())
+            first.passages['Start'].tags.append('changed')
+            first.passages['Start'].content = 'Changed'
+            first.story_init_vars['HP'] = 0
+            first.errors.append('oops')
+            del first.passages['StoryInit']
+
+            second = tw1x_cli.load_story(args, io.StringIO(), io.StringIO())
+            self.assertEqual(second.passages['Start'].tags, ['intro'])
+            self.assertEqual(second.passages['Start'].content, 'Hello')
+            self.assertEqual(second.story_init_vars, {'HP': 10})
+            self.assertEqual(second.errors, [])
+            self.assertIn('StoryInit', second.passages)
+
+    def test_parse_pickled_for_later_processes(self):
+        """Test with a cache dir a fresh process loads the pickle instead of reparsing."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'story.twee')
+            cache_dir = os.path.join(tmp, 'cache')
+            with open(path, 'w') as f:
+                f.write(':: Start\nHello [[Next]]\n\n:: Next\nBye\n')
+
+            args = argparse.Namespace(file=path, cache_dir=cache_dir)
+            first = tw1x_cli.load_story(args, io.StringIO(), io.StringIO())
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            self.assertFalse(os.path.exists(path + '.pkl'))
+
+            # Simulate a new process: drop the in-memory tier
+            tw1x_cli._parse_story_file.cache_clear()
+            second = tw1x_cli.load_story(args, io.StringIO(), io.StringIO())
+            self.assertIsNot(first, second)
+            self.assertEqual(second.passages, first.passages)
+            self.assertEqual(second.passage_names, {'Start', 'Next'})
+
+            # A stale pickle (different size) is ignored
+            with open(path, 'a') as f:
+                f.write('\n:: Third\nMore\n')
+            tw1x_cli._parse_story_file.cache_clear()
+            third = tw1x_cli.load_story(args, io.StringIO(), io.StringIO())
+            self.assertIn('Third', third.passages)
+
+    def test_no_pickle_without_cache_dir(self):
+        """Test the default neither writes nor loads pickles next to the story."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'story.twee')
+            with open(path, 'w') as f:
+                f.write(':: Start\nHello\n')
+            # A planted pickle must never be unpickled
+            with open(path + '.pkl', 'wb') as f:
+                f.write(b'not a pickle')
+
+            tw1x_cli._parse_story_file.cache_clear()
+            output = json.loads(run_cli(f'parse {path}'))
+            self.assertEqual(output['passage_count'], 1)
+            self.assertEqual(sorted(os.listdir(tmp)), ['story.twee', 'story.twee.pkl'])
+
+    def test_cache_key_includes_version(self):
+        """Test a pickle written under another tw1x version is not loaded."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'story.twee')
+            cache_dir = os.path.join(tmp, 'cache')
+            with open(path, 'w') as f:
+                f.write(':: Start\nHello\n')
+
+            args = argparse.Namespace(file=path, cache_dir=cache_dir)
+            tw1x_cli.load_story(args, io.StringIO(), io.StringIO())
+            tw1x_cli._parse_story_file.cache_clear()
+
+            with mock.patch.object(tw1x_cli, '__version__', '0.0.0'), \
+                    mock.patch.object(tw1x_cli.pickle, 'load') as load:
+                tw1x_cli.load_story(args, io.StringIO(), io.StringIO())
+            load.assert_not_called()
+
+
 class TestCLIJSONOutput(unittest.TestCase):
     """Test JSON output formatting."""
 
-    def setUp(self):
-        """Set up test environment."""
-        self.cli = 'python3 tw1x_cli.py'
-        self.test_story = 'engine/games/barbarian/data/story.twee'
+    test_story = TEST_STORY
 
-        if not os.path.exists(self.test_story):
-            self.skipTest("Barbarian story file not found")
+    @classmethod
+    def setUpClass(cls):
+        """Share the once-parsed story with every test in the class."""
+        cls._preparsed = preparsed_test_story()
 
     def _run_cli(self, command: str, stdin_data: str = None) -> str:
         """Run CLI and return raw output."""
-        cmd_parts = ['python3', 'tw1x_cli.py'] + shlex.split(command)
+        return run_cli(command, stdin_data, self._preparsed)
+
+    def _run_cli_subprocess(self, command: str) -> str:
+        """Run the CLI script in a child interpreter and return raw output."""
+        cmd_parts = [sys.executable, str(CLI_SCRIPT)] + shlex.split(command)
         result = subprocess.run(
             cmd_parts,
-            input=stdin_data,
             capture_output=True,
             text=True
         )
         return result.stdout
 
     def test_output_is_valid_json(self):
-        """Test that all outputs are valid JSON."""
+        """Test that all outputs are valid JSON (via the script entry point)."""
         commands = [
             f'info {self.test_story}',
             f'parse {self.test_story}',
         ]
 
         for cmd in commands:
-            output = self._run_cli(cmd)
+            output = self._run_cli_subprocess(cmd)
             try:
                 json.loads(output)
             except json.JSONDecodeError:
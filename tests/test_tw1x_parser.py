@@ -11,12 +11,17 @@ from pathlib import Path
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
 
-from tw1x import TweeParser, ExpressionEvaluator
+from tw1x import TweeParser, ExpressionEvaluator, tw1x_cli
 
 
 class TestVariableExtraction(unittest.TestCase):
     """Test variable extraction from StoryInit and TestSetup passages."""
 
+    @classmethod
+    def setUpClass(cls):
+        """Create one parser instance shared by the tests."""
+        cls.parser = TweeParser()
+
     def test_storyinit_simple_variables(self):
         """Test basic variable extraction from StoryInit."""
         content = """
@@ -28,8 +33,7 @@ class TestVariableExtraction(unittest.TestCase):
 :: Start
 You are <<print $PLAYER_NAME>>.
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
+        result = self.parser.parse_twee(content)
 
         self.assertEqual(result.story_init_vars['PLAYER_NAME'], 'Thorgrim')
         self.assertEqual(result.story_init_vars['STRENGTH'], 18)
@@ -49,8 +53,7 @@ You are <<print $PLAYER_NAME>>.
 :: Start
 Test
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
+        result = self.parser.parse_twee(content)
 
         self.assertEqual(result.test_setup_vars['SCENARIO'], 0)
         self.assertEqual(result.test_setup_vars['PLAYER_NAME'], 'Thorgrim')
@@ -80,8 +83,7 @@ Test
 :: Start
 Test
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
+        result = self.parser.parse_twee(content)
 
         # Pass 1: Extract top-level vars
         self.assertEqual(result.test_setup_vars['SCENARIO'], 2)
@@ -90,6 +92,29 @@ Test
         self.assertEqual(result.test_setup_vars['HONOR'], 25)
         self.assertEqual(result.test_setup_vars['FINAL_VAR'], 100)
 
+    def test_vars_only_matches_full_parse(self):
+        """Test vars_only yields the same variables and only the special passages."""
+        content = """
+:: Start
+<<set $IGNORED to 1>>
+
+:: StoryInit
+<<set $HONOR to 10>>
+
+:: NotTestSetup
+Text
+
+:: TestSetup [$metadata]
+<<set $SCENARIO to 1>>
+<<if $SCENARIO is 1>><<set $HONOR to 20>><<endif>>
+"""
+        full = self.parser.parse_twee(content)
+        fast = self.parser.parse_twee(content, vars_only=True)
+
+        self.assertEqual(fast.story_init_vars, full.story_init_vars)
+        self.assertEqual(fast.test_setup_vars, full.test_setup_vars)
+        self.assertEqual(sorted(fast.passages), ['StoryInit', 'TestSetup'])
+
     def test_variable_types(self):
         """Test extraction of different variable types."""
         content = """
@@ -103,8 +128,7 @@ Test
 :: Start
 Test
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
+        result = self.parser.parse_twee(content)
 
         self.assertEqual(result.story_init_vars['STRING'], 'hello')
         self.assertEqual(result.story_init_vars['NUMBER'], 42)
@@ -182,6 +206,11 @@ class TestConditionalEvaluation(unittest.TestCase):
 class TestNestedConditionals(unittest.TestCase):
     """Test nested conditional blocks."""
 
+    @classmethod
+    def setUpClass(cls):
+        """Create one parser instance shared by the tests."""
+        cls.parser = TweeParser()
+
     def test_nested_if_blocks(self):
         """Test nested <<if>> blocks are properly evaluated."""
         content = """
@@ -206,8 +235,7 @@ class TestNestedConditionals(unittest.TestCase):
 :: Start
 Test
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
+        result = self.parser.parse_twee(content)
 
         # Outer condition should match
         self.assertEqual(result.test_setup_vars['OUTER'], 1)
@@ -241,17 +269,50 @@ Test
 :: Start
 Test
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
+        result = self.parser.parse_twee(content)
 
         self.assertEqual(result.test_setup_vars['LEVEL1'], 1)
         self.assertEqual(result.test_setup_vars['LEVEL2'], 1)
         self.assertEqual(result.test_setup_vars['LEVEL3'], 1)
 
+    def test_dead_branches_dropped(self):
+        """Test sets inside untaken branches (at any depth) never run."""
+        content = """
+:: TestSetup
+<<set $SCENARIO to 1>>
+<<set $BASE to $SCENARIO + 10>>
+
+<<if $SCENARIO is 1>>
+<<set $TAKEN to $BASE>>
+<<if $BASE is 99>>
+<<set $INNER to "dead">>
+<<else>>
+<<set $INNER to "live">>
+<<endif>>
+<<else>>
+<<set $TAKEN to "dead">>
+<<set $OTHER to 1>>
+<<endif>>
+
+:: Start
+Test
+"""
+        result = self.parser.parse_twee(content)
+
+        self.assertEqual(result.test_setup_vars['BASE'], 11)
+        self.assertEqual(result.test_setup_vars['TAKEN'], 11)
+        self.assertEqual(result.test_setup_vars['INNER'], 'live')
+        self.assertNotIn('OTHER', result.test_setup_vars)
+
 
 class TestElseIfChains(unittest.TestCase):
     """Test elseif and else clause handling."""
 
+    @classmethod
+    def setUpClass(cls):
+        """Create one parser instance shared by the tests."""
+        cls.parser = TweeParser()
+
     def test_elseif_first_match(self):
         """Test elseif when first condition matches."""
         content = """
@@ -269,8 +330,7 @@ class TestElseIfChains(unittest.TestCase):
 :: Start
 Test
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
+        result = self.parser.parse_twee(content)
 
         self.assertEqual(result.test_setup_vars['RESULT'], 'first')
 
@@ -291,8 +351,7 @@ Test
 :: Start
 Test
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
+        result = self.parser.parse_twee(content)
 
         self.assertEqual(result.test_setup_vars['RESULT'], 'second')
 
@@ -313,8 +372,7 @@ Test
 :: Start
 Test
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
+        result = self.parser.parse_twee(content)
 
         self.assertEqual(result.test_setup_vars['RESULT'], 'other')
 
@@ -339,19 +397,63 @@ Test
 :: Start
 Test
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
+        result = self.parser.parse_twee(content)
 
         self.assertEqual(result.test_setup_vars['HONOR'], 25)
 
 
+class TestVarsOnlyParsing(unittest.TestCase):
+    """Test vars_only parsing gives the same variables as a full parse."""
+
+    CASES = [
+        "",
+        ":: Start\nNo special passages\n",
+        ":: StoryInit\n<<set $STRING to \"hello\">>\n<<set $NUMBER to 42>>\n"
+        "<<set $FLOAT to 3.14>>\n<<set $BOOL to true>>\n",
+        ":: StoryInit\n<<set $HONOR to 10>>\n\n"
+        ":: TestSetup [$metadata]\n<<set $SCENARIO to 2>>\n"
+        "<<if $SCENARIO is 1>><<set $HONOR to 20>>"
+        "<<elseif $SCENARIO is 2>><<set $HONOR to 25>>"
+        "<<else>><<set $HONOR to 0>><<endif>>\n<<set $FINAL_VAR to 100>>\n",
+        ":: TestSetup\n<<set $SCENARIO to 1>>\n"
+        "<<if $SCENARIO is 1>><<set $OUTER to 1>>"
+        "<<if $SCENARIO is 1>><<set $INNER to 1>><<endif>><<endif>>\n",
+        ":: Start\n[[StoryInit]]\n\n:: StoryInitNotes\nText\n\n"
+        ":: StoryInit\n<<set $VAR to 1>>\n",
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        """Create one parser instance shared by the tests."""
+        cls.parser = TweeParser()
+
+    def test_vars_only_matches_full_parse(self):
+        """Test each story's variables match between vars_only and full parses."""
+        for content in self.CASES:
+            with self.subTest(content=content):
+                full = self.parser.parse_twee(content)
+                fast = self.parser.parse_twee(content, vars_only=True)
+
+                self.assertEqual(fast.story_init_vars, full.story_init_vars)
+                self.assertEqual(fast.test_setup_vars, full.test_setup_vars)
+                self.assertEqual(
+                    fast.passages,
+                    {name: passage for name, passage in full.passages.items()
+                     if name in ('StoryInit', 'TestSetup')}
+                )
+
+
 class TestEdgeCases(unittest.TestCase):
     """Test edge cases and error handling."""
 
+    @classmethod
+    def setUpClass(cls):
+        """Create one parser instance shared by the tests."""
+        cls.parser = TweeParser()
+
     def test_empty_content(self):
         """Test parser handles empty content."""
-        parser = TweeParser()
-        result = parser.parse_twee("")
+        result = self.parser.parse_twee("")
 
         self.assertIsNotNone(result)
         self.assertEqual(result.story_init_vars, {})
@@ -363,8 +465,7 @@ class TestEdgeCases(unittest.TestCase):
 :: Start
 Test content
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
+        result = self.parser.parse_twee(content)
 
         self.assertEqual(result.story_init_vars, {})
 
@@ -377,8 +478,7 @@ Test content
 :: Start
 Test
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
+        result = self.parser.parse_twee(content)
 
         self.assertIn('VAR', result.story_init_vars)
         self.assertEqual(result.test_setup_vars, {})
@@ -387,9 +487,7 @@ Test
 class TestRealWorldScenarios(unittest.TestCase):
     """Test real-world scenarios from the barbarian game."""
 
-    def test_barbarian_storyinit(self):
-        """Test actual barbarian game StoryInit."""
-        content = """
+    STORYINIT_CONTENT = """
 :: StoryInit
 <<set $PLAYER_NAME to "Thorgrim">>
 <<set $STRENGTH to 18>>
@@ -403,21 +501,8 @@ class TestRealWorldScenarios(unittest.TestCase):
 :: Start
 You are <<print $PLAYER_NAME>>.
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
-
-        self.assertEqual(result.story_init_vars['PLAYER_NAME'], 'Thorgrim')
-        self.assertEqual(result.story_init_vars['STRENGTH'], 18)
-        self.assertEqual(result.story_init_vars['RAGE'], 0)
-        self.assertEqual(result.story_init_vars['HONOR'], 10)
-        self.assertEqual(result.story_init_vars['QUEST_STATE'], 0)
-        self.assertEqual(result.story_init_vars['HAS_WEAPON'], 0)
-        self.assertEqual(result.story_init_vars['HAS_BLESSING'], 0)
-        self.assertEqual(result.story_init_vars['WEAPON_POWER'], 25)
 
-    def test_barbarian_testsetup_scenario_2(self):
-        """Test barbarian TestSetup scenario 2 (Ready for dragon)."""
-        content = """
+    TESTSETUP_CONTENT = """
 :: StoryInit
 <<set $HONOR to 10>>
 <<set $HAS_WEAPON to 0>>
@@ -446,18 +531,8 @@ You are <<print $PLAYER_NAME>>.
 :: Start
 Test
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
 
-        self.assertEqual(result.test_setup_vars['SCENARIO'], 2)
-        self.assertEqual(result.test_setup_vars['HONOR'], 20)
-        self.assertEqual(result.test_setup_vars['HAS_WEAPON'], 1)
-        self.assertEqual(result.test_setup_vars['WEAPON_POWER'], 40)
-        self.assertEqual(result.test_setup_vars['HAS_BLESSING'], 1)
-
-    def test_shaman_nested_conditional(self):
-        """Test the SHAMAN passage nested conditional logic."""
-        content = """
+    SHAMAN_CONTENT = """
 :: StoryInit
 <<set $HAS_BLESSING to 0>>
 <<set $HONOR to 10>>
@@ -479,11 +554,42 @@ You already have blessing.
 :: Start
 Test
 """
-        parser = TweeParser()
-        result = parser.parse_twee(content)
 
+    @classmethod
+    def setUpClass(cls):
+        """Parse each scenario once for every test in the class."""
+        cls.parser = TweeParser()
+        cls.result_storyinit = cls.parser.parse_twee(cls.STORYINIT_CONTENT)
+        cls.result_testsetup = cls.parser.parse_twee(cls.TESTSETUP_CONTENT)
+        cls.result_shaman = cls.parser.parse_twee(cls.SHAMAN_CONTENT)
+
+    def test_barbarian_storyinit(self):
+        """Test actual barbarian game StoryInit."""
+        init_vars = self.result_storyinit.story_init_vars
+
+        self.assertEqual(init_vars['PLAYER_NAME'], 'Thorgrim')
+        self.assertEqual(init_vars['STRENGTH'], 18)
+        self.assertEqual(init_vars['RAGE'], 0)
+        self.assertEqual(init_vars['HONOR'], 10)
+        self.assertEqual(init_vars['QUEST_STATE'], 0)
+        self.assertEqual(init_vars['HAS_WEAPON'], 0)
+        self.assertEqual(init_vars['HAS_BLESSING'], 0)
+        self.assertEqual(init_vars['WEAPON_POWER'], 25)
+
+    def test_barbarian_testsetup_scenario_2(self):
+        """Test barbarian TestSetup scenario 2 (Ready for dragon)."""
+        test_vars = self.result_testsetup.test_setup_vars
+
+        self.assertEqual(test_vars['SCENARIO'], 2)
+        self.assertEqual(test_vars['HONOR'], 20)
+        self.assertEqual(test_vars['HAS_WEAPON'], 1)
+        self.assertEqual(test_vars['WEAPON_POWER'], 40)
+        self.assertEqual(test_vars['HAS_BLESSING'], 1)
+
+    def test_shaman_nested_conditional(self):
+        """Test the SHAMAN passage nested conditional logic."""
         # Verify passages are parsed
-        self.assertIn('SHAMAN', result.passages)
+        self.assertIn('SHAMAN', self.result_shaman.passages)
 
 
 class TestIntegrationWithCLI(unittest.TestCase):
@@ -491,9 +597,8 @@ class TestIntegrationWithCLI(unittest.TestCase):
 
     def test_cli_parse_command(self):
         """Test CLI parse command returns proper JSON."""
-        import subprocess
+        import io
         import json
-        import tempfile
 
         content = """
 :: StoryInit
@@ -503,29 +608,16 @@ class TestIntegrationWithCLI(unittest.TestCase):
 Test
 """
 
-        # Create temp file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.twee', delete=False, encoding='utf-8') as f:
-            f.write(content)
-            temp_path = f.name
-
-        try:
-            # Run CLI
-            result = subprocess.run(
-                ['python3', 'tw1x_cli.py', 'parse', temp_path],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-
-            self.assertEqual(result.returncode, 0)
-
-            # Parse JSON output
-            data = json.loads(result.stdout)
-            self.assertIn('story_init_vars', data)
-            self.assertEqual(data['story_init_vars']['VAR'], 42)
-
-        finally:
-            Path(temp_path).unlink()
+        # Run CLI in-process, passing the story on stdin
+        stdout = io.StringIO()
+        returncode = tw1x_cli.main(['parse', '-'], stdin=io.StringIO(content), stdout=stdout)
+
+        self.assertEqual(returncode, 0)
+
+        # Parse JSON output
+        data = json.loads(stdout.getvalue())
+        self.assertIn('story_init_vars', data)
+        self.assertEqual(data['story_init_vars']['VAR'], 42)
 
 
 def run_tests():
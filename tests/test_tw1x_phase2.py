@@ -13,9 +13,12 @@ Tests for:
 Run with: python3 test_tw1x_phase2.py
 """
 
+import os
+import tracemalloc
 import unittest
+from unittest import mock
 from tw1x import (
-    TweeParser, parse_twee, parse_value,
+    TweeParser, Passage, parse_twee, parse_value,
     ExpressionEvaluator, MacroProcessor,
     VariableScope, ExecutionMode
 )
@@ -54,6 +57,14 @@ class TestValueParsing(unittest.TestCase):
         self.assertEqual(parse_value("hello"), "hello")
         self.assertEqual(parse_value("test"), "test")
 
+    def test_parse_near_misses(self):
+        """Test values that only look like another type stay strings."""
+        self.assertEqual(parse_value('"unclosed'), '"unclosed')
+        self.assertEqual(parse_value("trueish"), "trueish")
+        self.assertEqual(parse_value("1e5"), "1e5")
+        self.assertEqual(parse_value("  7 "), 7)
+        self.assertEqual(parse_value(""), "")
+
 
 class TestExpressionEvaluator(unittest.TestCase):
     """Test expression evaluation."""
@@ -130,11 +141,101 @@ class TestExpressionEvaluator(unittest.TestCase):
         result = self.evaluator.evaluate('$health + 10')
         self.assertEqual(result, 110)
 
+    def test_variable_case_insensitive_sees_new_keys(self):
+        """Test case-insensitive lookup picks up variables added later."""
+        self.assertEqual(self.evaluator.evaluate('$later'), "")
+        self.evaluator.variables['LATER'] = 5
+        self.assertEqual(self.evaluator.evaluate('$later'), 5)
+        self.evaluator.variables = {'Other': 1}
+        self.assertEqual(self.evaluator.evaluate('$health'), "")
+
+    def test_variable_case_insensitive_after_same_size_change(self):
+        """Test writes keep the index current; direct same-size edits need variables_changed()."""
+        variables = {'A': 1}
+        evaluator = ExpressionEvaluator(variables)
+        self.assertEqual(evaluator.evaluate('$zz'), "")
+        evaluator.set_variable('ZZ', 7)
+        self.assertEqual(evaluator.evaluate('$zz'), 7)
+
+        del variables['A']
+        variables['YY'] = 8
+        evaluator.variables_changed()
+        self.assertEqual(evaluator.evaluate('$yy'), 8)
+        self.assertEqual(evaluator.evaluate('$a'), "")
+
+    def test_variable_case_insensitive_miss_does_not_scan(self):
+        """Test an unset variable is answered from the index, not a scan of the store."""
+        class Store(dict):
+            scans = 0
+
+            def items(self):
+                Store.scans += 1
+                return super().items()
+
+            def __iter__(self):
+                Store.scans += 1
+                return super().__iter__()
+
+        evaluator = ExpressionEvaluator(Store(HEALTH=100))
+        self.assertEqual(evaluator.evaluate('$health'), 100)
+        scans = Store.scans
+        for _ in range(3):
+            self.assertEqual(evaluator.evaluate('$unset'), "")
+        self.assertEqual(Store.scans, scans)
+
     def test_missing_variable(self):
         """Test missing variable returns empty string."""
         result = self.evaluator.evaluate('$MISSING_VAR + "test"')
         self.assertEqual(result, "test")
 
+    def test_either_function(self):
+        """Test either() picks one of its arguments on each evaluation."""
+        for _ in range(10):
+            result = self.evaluator.evaluate('either("a", "b", $NAME)')
+            self.assertIn(result, ("a", "b", "Thorgrim"))
+
+    def test_random_function(self):
+        """Test random() stays within bounds and concatenates as a string."""
+        for _ in range(10):
+            result = self.evaluator.evaluate('"Roll: " + random(1, 6)')
+            self.assertIn(result, [f"Roll: {n}" for n in range(1, 7)])
+
+    def test_string_variable_with_quotes(self):
+        """Test string values containing quotes are not re-parsed."""
+        self.variables['QUOTE'] = 'He said "hi"'
+        result = self.evaluator.evaluate('$QUOTE + "!"')
+        self.assertEqual(result, 'He said "hi"!')
+
+    def test_rejects_attribute_access(self):
+        """Test expressions cannot reach Python attributes."""
+        result = self.evaluator.evaluate('"".__class__')
+        self.assertIsNone(result)
+        self.assertEqual(len(self.evaluator.errors), 1)
+
+    def test_operator_words_inside_strings(self):
+        """Test text operators are only translated outside string literals."""
+        self.variables['X'] = 3
+        self.assertEqual(self.evaluator.evaluate('"is it" + " or not"'), 'is it or not')
+        self.assertTrue(self.evaluator.evaluate('$X is 3 and "a" is "a"'))
+
+    def test_short_circuit_and_chained_comparison(self):
+        """Test and/or stop at the deciding operand; comparisons chain."""
+        self.variables['ZERO'] = 0
+        self.assertFalse(self.evaluator.evaluate('$ZERO neq 0 and 10 / $ZERO > 1'))
+        self.assertEqual(self.evaluator.evaluate('$ZERO or "fallback"'), 'fallback')
+        self.assertTrue(self.evaluator.evaluate('1 < 2 <= 2'))
+        self.assertFalse(self.evaluator.evaluate('1 < 3 < 2'))
+        self.assertEqual(self.evaluator.errors, [])
+
+    def test_skipped_branch_does_not_roll(self):
+        """Test either()/random() in a short-circuited branch leave the RNG alone."""
+        self.variables['FLAG'] = 0
+        with mock.patch('tw1x.tw1x.random_module') as rng:
+            self.assertEqual(self.evaluator.evaluate('$FLAG and either("a", "b")'), 0)
+            self.assertEqual(self.evaluator.evaluate('not $FLAG or random(1, 6)'), True)
+        rng.choice.assert_not_called()
+        rng.randint.assert_not_called()
+
 
 class TestMacroProcessor(unittest.TestCase):
     """Test macro processing."""
@@ -154,6 +255,64 @@ class TestMacroProcessor(unittest.TestCase):
         self.processor.process_set_macro('set $NAME to "Thorgrim"')
         self.assertEqual(self.variables['NAME'], "Thorgrim")
 
+    def test_set_macro_literal_values(self):
+        """Test literal <<set>> values match what the evaluator produces."""
+        self.processor.process_set_macro('set $A to 18')
+        self.processor.process_set_macro('set $B to -2.5')
+        self.processor.process_set_macro("set $C to 'it\\'s'")
+        self.processor.process_set_macro('set $D to [1, 2]')
+        self.processor.process_set_macro('set $E to [1, 2]')
+
+        self.assertEqual(self.variables['A'], 18)
+        self.assertEqual(self.variables['B'], -2.5)
+        self.assertEqual(self.variables['C'], "it's")
+        # Lists are built fresh by each <<set>>, never shared
+        self.assertEqual(self.variables['D'], [1, 2])
+        self.assertIsNot(self.variables['D'], self.variables['E'])
+
+    def test_set_macro_constant_expressions(self):
+        """Test literal-only expressions assign their value; errors still report."""
+        self.processor.process_set_macro('set $GREETING to "Hello " + "World"')
+        self.processor.process_set_macro('set $SUM to 3 + 4')
+        self.processor.process_set_macro('set $SAME to "a" is "a"')
+        self.processor.process_set_macro('set $BAD to 1 / 0')
+        self.processor.process_set_macro('set $BAD to 1 / 0')
+
+        self.assertEqual(self.variables['GREETING'], "Hello World")
+        self.assertEqual(self.variables['SUM'], 7)
+        self.assertIs(self.variables['SAME'], True)
+        self.assertEqual(len(self.processor.evaluator.errors), 2)
+
+    def test_unrun_branch_does_not_build_constants(self):
+        """Test a large constant in a branch that never runs is not built."""
+        parser = TweeParser()
+        passage = Passage('Test', [], '<<if false>><<set $BIG to "a" * 50000000>><<endif>>Done', '')
+
+        tracemalloc.start()
+        try:
+            result = parser.render_passage(passage, {})
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(result.text, 'Done')
+        self.assertLess(peak, 10 * 1024 * 1024)
+
+        # When the <<set>> does run, it still evaluates
+        self.processor.process_set_macro('set $X to "ab" * 3')
+        self.assertEqual(self.variables['X'], 'ababab')
+
+    def test_set_macro_repeated(self):
+        """Test a repeated <<set>> re-evaluates and re-reports each time."""
+        self.processor.process_set_macro('set $N to 1')
+        self.processor.process_set_macro('set $N += $N')
+        self.processor.process_set_macro('set $N += $N')
+        self.processor.process_set_macro('set N to 1')
+        self.processor.process_set_macro('set N to 1')
+
+        self.assertEqual(self.variables['N'], 4)
+        self.assertEqual(len(self.processor.errors), 2)
+
     def test_set_macro_with_expression(self):
         """Test <<set>> with expression."""
         self.variables['HEALTH'] = 100
@@ -233,6 +392,20 @@ Your name is <<print $NAME>>.
 
         self.assertIn('Your name is Thorgrim', render_result.text)
 
+    def test_render_print_variable_and_literal(self):
+        """Test <<print>> of a bare variable or a literal."""
+        content = """
+:: Test
+<<print $name>>|<<print $MISSING>>|<<print "lit">>|<<print 7>>|<<print $N + 1>>
+"""
+        result = parse_twee(content)
+        parser = TweeParser()
+        passage = result.passages['Test']
+
+        render_result = parser.render_passage(passage, {'NAME': 'Thorgrim', 'N': 1})
+
+        self.assertEqual(render_result.text, 'Thorgrim||lit|7|2')
+
     def test_render_with_conditionals(self):
         """Test rendering with <<if>> conditionals."""
         content = """
@@ -287,6 +460,169 @@ Critical
         render_result = parser.render_passage(passage, {'HEALTH': 30})
         self.assertIn('Critical', render_result.text)
 
+    def test_render_print_sees_earlier_set(self):
+        """Test <<print>> shows the value set before it, not the final value."""
+        content = """
+:: Test
+Before: <<print $GOLD>>
+<<set $GOLD to $GOLD + 10>>
+After: <<print $GOLD>>
+"""
+        result = parse_twee(content)
+        parser = TweeParser()
+        passage = result.passages['Test']
+
+        variables = {'GOLD': 50}
+        render_result = parser.render_passage(passage, variables)
+
+        self.assertIn('Before: 50', render_result.text)
+        self.assertIn('After: 60', render_result.text)
+        self.assertEqual(variables['GOLD'], 60)
+
+    def test_render_reports_variable_changes(self):
+        """Test variable_changes holds only the variables set during render."""
+        content = """
+:: Test
+<<set $GOLD += 5>><<set $VISITED to "yes">>
+"""
+        result = parse_twee(content)
+        parser = TweeParser()
+
+        variables = {'GOLD': 10, 'HEALTH': 100}
+        render_result = parser.render_passage(result.passages['Test'], variables)
+
+        self.assertEqual(render_result.variable_changes, {'GOLD': 15, 'VISITED': 'yes'})
+        self.assertEqual(variables, {'GOLD': 15, 'HEALTH': 100, 'VISITED': 'yes'})
+
+    def test_render_static_passage(self):
+        """Test passages without macros render as written, links included."""
+        result = parse_twee(":: Test\nA quiet hall.\n[[Go north|North]] or [[South]]\n")
+        parser = TweeParser()
+        passage = result.passages['Test']
+
+        render_result = parser.render_passage(passage, {'HEALTH': 1})
+        self.assertEqual(render_result.text, 'A quiet hall.\n[[Go north|North]] or [[South]]')
+        self.assertEqual([l.target for l in render_result.links], ['North', 'South'])
+        self.assertEqual(render_result.variable_changes, {})
+
+        # Results get their own links; editing the passage is picked up
+        render_result.links[0].setters.append(('$GOLD', '=', '1'))
+        self.assertEqual(parser.render_passage(passage, {}).links[0].setters, [])
+        self.assertEqual(passage.to_dict()['links'][0]['setters'], [])
+        render_result.links.clear()
+        passage.content = "Now <<print $HEALTH>> [[East]]"
+        render_result = parser.render_passage(passage, {'HEALTH': 1})
+        self.assertEqual(render_result.text, 'Now 1 [[East]]')
+        self.assertEqual([l.target for l in render_result.links], ['East'])
+
+    def test_render_constant_sets_each_time(self):
+        """Test constant <<set>>s apply on every render; bad ones keep erroring."""
+        content = """
+:: Test
+<<if $X>><<set $A to 1>><<else>><<set $A = "no">><<endif>><<print $A>><<set A to 2>>
+"""
+        result = parse_twee(content)
+        parser = TweeParser()
+        passage = result.passages['Test']
+
+        for x, expected in ((1, '1'), (0, 'no'), (1, '1')):
+            render_result = parser.render_passage(passage, {'X': x})
+            self.assertEqual(render_result.text.strip(), expected)
+            self.assertEqual(len(render_result.errors), 1)
+
+    def test_render_invalid_expressions_each_time(self):
+        """Test invalid conditions and prints fail the same way on every render."""
+        content = """
+:: Test
+<<if $X +>>yes<<elseif $X is 2>>two<<else>>no<<endif>>|<<print $X *>>|<<print $X * 2>>
+"""
+        result = parse_twee(content)
+        parser = TweeParser()
+        passage = result.passages['Test']
+
+        for x, expected in ((1, 'no||2'), (2, 'two||4'), (1, 'no||2')):
+            render_result = parser.render_passage(passage, {'X': x})
+            self.assertEqual(render_result.text, expected)
+
+    def test_render_with_display(self):
+        """Test <<display>> renders another passage inline."""
+        content = """
+:: Test
+Header
+<<display "Footer">>
+
+:: Footer
+HP: <<print $HEALTH>>
+
+:: Loop
+<<display "Loop">>
+"""
+        result = parse_twee(content)
+        parser = TweeParser()
+
+        render_result = parser.render_passage(
+            result.passages['Test'], {'HEALTH': 7}, passages=result.passages
+        )
+        self.assertIn('HP: 7', render_result.text)
+        self.assertEqual(render_result.errors, [])
+
+        render_result = parser.render_passage(
+            result.passages['Loop'], {}, passages=result.passages
+        )
+        self.assertTrue(any('Circular' in e for e in render_result.errors))
+
+    def test_render_display_case_insensitive(self):
+        """Test <<display>> falls back to a case-insensitive name match."""
+        result = parse_twee(':: Test\n<<display "footer">>\n\n:: Footer\nBottom\n')
+        parser = TweeParser()
+        passages = result.passages
+
+        render_result = parser.render_passage(passages['Test'], {}, passages=passages)
+        self.assertEqual(render_result.text.strip(), 'Bottom')
+
+        # Passages added after the first lookup are found too
+        passages['Test'].content = '<<display "SIDEBAR">>'
+        passages['Sidebar'] = Passage('Sidebar', [], 'Side', 'Side')
+        render_result = parser.render_passage(passages['Test'], {}, passages=passages)
+        self.assertEqual(render_result.text.strip(), 'Side')
+        self.assertEqual(render_result.errors, [])
+
+    def test_render_display_case_insensitive_after_rename(self):
+        """Test a renamed passage (same passage count) is found case-insensitively."""
+        result = parse_twee(':: Test\n<<display "old">>\n\n:: Old\nBefore\n')
+        parser = TweeParser()
+        passages = result.passages
+        self.assertEqual(parser.render_passage(passages['Test'], {}, passages=passages).text, 'Before')
+
+        passages['Inner'] = passages.pop('Old')
+        passages['Test'].content = '<<display "inner">>'
+        render_result = parser.render_passage(passages['Test'], {}, passages=passages)
+        self.assertEqual(render_result.text, 'Before')
+        self.assertEqual(render_result.errors, [])
+
+    def test_render_display_errors_reported_once(self):
+        """Test macro errors from displayed passages are reported once, in order."""
+        content = """
+:: Test
+<<display "Inner">><<set Y to 2>><<display "Inner">>
+
+:: Inner
+<<set X to 1>><<set $N to 3>>
+"""
+        result = parse_twee(content)
+        parser = TweeParser()
+
+        variables = {}
+        render_result = parser.render_passage(
+            result.passages['Test'], variables, passages=result.passages
+        )
+        self.assertEqual(render_result.errors, [
+            'Invalid <<set>> syntax: set X to 1',
+            'Invalid <<set>> syntax: set X to 1',
+            'Invalid <<set>> syntax: set Y to 2',
+        ])
+        self.assertEqual(variables, {'N': 3})
+
     def test_render_with_nobr(self):
         """Test <<nobr>> macro removes line breaks."""
         content = """
@@ -305,22 +641,42 @@ Line three
         # Should have spaces instead of newlines
         self.assertIn('Line one Line two Line three', render_result.text)
 
+    def test_rerender_reuses_compiled_passage(self):
+        """Test repeated renders share one compiled tree but see new variables."""
+        content = """
+:: Test
+<<if $GOLD > 5>>Rich<<else>>Poor<<endif>>
+"""
+        result = parse_twee(content)
+        parser = TweeParser()
+        passage = result.passages['Test']
+
+        self.assertEqual(parser.render_passage(passage, {'GOLD': 10}).text, 'Rich')
+        compiled = passage._compiled
+        self.assertEqual(parser.render_passage(passage, {'GOLD': 1}).text, 'Poor')
+        self.assertIs(passage._compiled, compiled)
+
+        # Editing the content invalidates the cached tree
+        passage.content = "Gold: <<print $GOLD>>"
+        self.assertEqual(parser.render_passage(passage, {'GOLD': 3}).text, 'Gold: 3')
+
 
 class TestBarbarianStoryWithVariables(unittest.TestCase):
     """Integration test with barbarian story and variable rendering."""
 
-    def test_barbarian_story_init(self):
-        """Test that barbarian StoryInit variables are parsed."""
-        import os
+    story_path = 'engine/games/barbarian/data/story.twee'
 
-        story_path = 'engine/games/barbarian/data/story.twee'
-        if not os.path.exists(story_path):
-            self.skipTest("Barbarian story file not found")
+    @classmethod
+    def setUpClass(cls):
+        """Parse the story once for every test in the class."""
+        if not os.path.exists(cls.story_path):
+            raise unittest.SkipTest("Barbarian story file not found")
 
-        with open(story_path, 'r') as f:
-            content = f.read()
+        cls._result = TweeParser().parse_twee_file(cls.story_path)
 
-        result = parse_twee(content)
+    def test_barbarian_story_init(self):
+        """Test that barbarian StoryInit variables are parsed."""
+        result = self._result
 
         # Verify StoryInit variables were extracted
         self.assertIn('PLAYER_NAME', result.story_init_vars)
@@ -336,16 +692,7 @@ class TestBarbarianStoryWithVariables(unittest.TestCase):
 
     def test_render_start_passage(self):
         """Test rendering the Start passage with variables."""
-        import os
-
-        story_path = 'engine/games/barbarian/data/story.twee'
-        if not os.path.exists(story_path):
-            self.skipTest("Barbarian story file not found")
-
-        with open(story_path, 'r') as f:
-            content = f.read()
-
-        result = parse_twee(content)
+        result = self._result
         parser = TweeParser()
 
         # Get Start passage
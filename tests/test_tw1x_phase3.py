@@ -11,8 +11,9 @@ Tests for:
 Run with: python3 test_tw1x_phase3.py
 """
 
+import os
 import unittest
-from tw1x import parse_twee
+from tw1x import parse_twee, TweeParser
 
 
 class TestStoryInitProcessing(unittest.TestCase):
@@ -187,33 +188,51 @@ Game starts.
         self.assertEqual(result.test_setup_vars['VAR2'], 2)
         self.assertEqual(result.test_setup_vars['VAR3'], 3)
 
+    def test_testsetup_rerun_with_override(self):
+        """Test rerunning TestSetup with a forced SCENARIO."""
+        content = """
+:: TestSetup
+<<set $SCENARIO to 0>>
+<<set $HEALTH to 100>>
+<<if $SCENARIO is 0>>
+<<set $HEALTH to 50>>
+<<elseif $SCENARIO is 1>>
+<<set $HEALTH += 5>>
+<</if>>
+"""
+        parser = TweeParser()
+        result = parser.parse_twee(content)
+
+        self.assertEqual(parser.rerun_test_setup(result), result.test_setup_vars)
+        self.assertEqual(parser.rerun_test_setup(result, {'SCENARIO': 1}),
+                         {'SCENARIO': 1, 'HEALTH': 105})
+        self.assertEqual(parser.rerun_test_setup(result, {'SCENARIO': 2}),
+                         {'SCENARIO': 2, 'HEALTH': 100})
+        # The original parse is untouched
+        self.assertEqual(result.test_setup_vars, {'SCENARIO': 0, 'HEALTH': 50})
+
 
 class TestBarbarianStoryScenarios(unittest.TestCase):
     """Test all barbarian story TestSetup scenarios."""
 
-    def _load_barbarian_story_with_scenario(self, scenario_num):
-        """Helper to load barbarian story and modify SCENARIO."""
-        import os
-
-        story_path = 'engine/games/barbarian/data/story.twee'
-        if not os.path.exists(story_path):
-            self.skipTest("Barbarian story file not found")
+    story_path = 'engine/games/barbarian/data/story.twee'
 
-        with open(story_path, 'r') as f:
-            content = f.read()
+    @classmethod
+    def setUpClass(cls):
+        """Parse the story once for every scenario."""
+        if not os.path.exists(cls.story_path):
+            raise unittest.SkipTest("Barbarian story file not found")
 
-        # Replace SCENARIO value
-        content = content.replace(
-            '<<set $SCENARIO to 9>>',
-            f'<<set $SCENARIO to {scenario_num}>>'
-        )
+        cls._parser = TweeParser()
+        cls._result = cls._parser.parse_twee_file(cls.story_path, vars_only=True)
 
-        return parse_twee(content)
+    def _load_barbarian_story_with_scenario(self, scenario_num):
+        """Helper to rerun the barbarian TestSetup with SCENARIO overridden."""
+        return self._parser.rerun_test_setup(self._result, {'SCENARIO': scenario_num})
 
     def test_scenario_0_default(self):
         """Test SCENARIO=0 (default settings)."""
-        result = self._load_barbarian_story_with_scenario(0)
-        vars = result.test_setup_vars
+        vars = self._load_barbarian_story_with_scenario(0)
 
         self.assertEqual(vars['SCENARIO'], 0)
         self.assertEqual(vars['PLAYER_NAME'], "Thorgrim")
@@ -227,8 +246,7 @@ class TestBarbarianStoryScenarios(unittest.TestCase):
 
     def test_scenario_1_furious(self):
         """Test SCENARIO=1 (Thorgrim the Furious)."""
-        result = self._load_barbarian_story_with_scenario(1)
-        vars = result.test_setup_vars
+        vars = self._load_barbarian_story_with_scenario(1)
 
         self.assertEqual(vars['SCENARIO'], 1)
         self.assertEqual(vars['PLAYER_NAME'], "Thorgrim the Furious")
@@ -242,8 +260,7 @@ class TestBarbarianStoryScenarios(unittest.TestCase):
 
     def test_scenario_2_honorable(self):
         """Test SCENARIO=2 (Thorgrim the Honorable)."""
-        result = self._load_barbarian_story_with_scenario(2)
-        vars = result.test_setup_vars
+        vars = self._load_barbarian_story_with_scenario(2)
 
         self.assertEqual(vars['SCENARIO'], 2)
         self.assertEqual(vars['PLAYER_NAME'], "Thorgrim the Honorable")
@@ -254,8 +271,7 @@ class TestBarbarianStoryScenarios(unittest.TestCase):
 
     def test_scenario_3_champion(self):
         """Test SCENARIO=3 (Thorgrim the Champion)."""
-        result = self._load_barbarian_story_with_scenario(3)
-        vars = result.test_setup_vars
+        vars = self._load_barbarian_story_with_scenario(3)
 
         self.assertEqual(vars['SCENARIO'], 3)
         self.assertEqual(vars['PLAYER_NAME'], "Thorgrim the Champion")
@@ -266,8 +282,7 @@ class TestBarbarianStoryScenarios(unittest.TestCase):
 
     def test_scenario_4_mid_quest(self):
         """Test SCENARIO=4 (mid-quest state)."""
-        result = self._load_barbarian_story_with_scenario(4)
-        vars = result.test_setup_vars
+        vars = self._load_barbarian_story_with_scenario(4)
 
         self.assertEqual(vars['SCENARIO'], 4)
         self.assertEqual(vars['HONOR'], 15)
@@ -276,8 +291,7 @@ class TestBarbarianStoryScenarios(unittest.TestCase):
 
     def test_scenario_5_specific_state(self):
         """Test SCENARIO=5 (specific test state)."""
-        result = self._load_barbarian_story_with_scenario(5)
-        vars = result.test_setup_vars
+        vars = self._load_barbarian_story_with_scenario(5)
 
         self.assertEqual(vars['SCENARIO'], 5)
         self.assertEqual(vars['RAGE'], 15)
@@ -286,8 +300,7 @@ class TestBarbarianStoryScenarios(unittest.TestCase):
 
     def test_scenario_6_weak_warrior(self):
         """Test SCENARIO=6 (weak warrior)."""
-        result = self._load_barbarian_story_with_scenario(6)
-        vars = result.test_setup_vars
+        vars = self._load_barbarian_story_with_scenario(6)
 
         self.assertEqual(vars['SCENARIO'], 6)
         self.assertEqual(vars['PLAYER_NAME'], "Weak Warrior")
@@ -337,6 +350,20 @@ Content.
 
         self.assertEqual(len(result.test_setup_vars), 0)
 
+    def test_testsetup_reparse_gets_fresh_variables(self):
+        """Test reparsing an unchanged TestSetup does not share state."""
+        content = """
+:: TestSetup
+<<set $S to 1>>
+<<if $S is 1>><<set $HITS += 1>><<else>><<set $HITS to 99>><</if>>
+"""
+        first = parse_twee(content)
+        second = parse_twee(content)
+
+        self.assertEqual(first.test_setup_vars, {'S': 1, 'HITS': 1})
+        self.assertEqual(second.test_setup_vars, {'S': 1, 'HITS': 1})
+        self.assertIsNot(first.test_setup_vars, second.test_setup_vars)
+
 
 # ============================================================================
 # Main - Run tests
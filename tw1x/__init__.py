@@ -28,9 +28,11 @@ from .tw1x import (
 
     # Utilities
     parse_value,
+
+    # Version (also used to key the CLI's parse cache)
+    __version__,
 )
 
-__version__ = "0.3.0"
 __author__ = "Development Team"
 __all__ = [
     # Parser
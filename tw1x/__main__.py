@@ -1,7 +1,9 @@
 """
 Allow tw1x to be run as a module: python3 -m tw1x
 """
+import sys
+
 from tw1x.tw1x_cli import main
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
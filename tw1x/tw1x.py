@@ -11,11 +11,20 @@ Version: 0.3.0 (Phase 3: Special Passages - StoryInit & TestSetup)
 Date: 2025-10-25
 """
 
+__version__ = "0.3.0"
+
+from collections import ChainMap
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Any, Union, Tuple
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple, Union
 from enum import Enum
+import ast
+import functools
+import mmap
+import operator
+import os
 import re
 import random as random_module
+import sys
 
 
 # ============================================================================
@@ -39,7 +48,11 @@ class ExecutionMode(Enum):
 # Data Structures
 # ============================================================================
 
-@dataclass
+# dataclass(slots=True) needs Python 3.10+; older interpreters keep __dict__
+_DATACLASS_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_DATACLASS_SLOTS)
 class Passage:
     """Represents a parsed Twee passage."""
     name: str
@@ -47,13 +60,43 @@ class Passage:
     content: str
     raw_content: str
     image_url: Optional[str] = None
+    _links: Optional[Tuple[str, List['Link']]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _compiled: Optional[Tuple[str, List['_Node']]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     def __repr__(self):
         tags_str = f"[{', '.join(self.tags)}]" if self.tags else ""
         return f"Passage('{self.name}' {tags_str})"
 
+    @property
+    def links(self) -> List['Link']:
+        """
+        Links in the passage content.
 
-@dataclass
+        Scanned on first access and cached until content is reassigned.
+        The returned list is shared; copy it before mutating.
+        """
+        cached = self._links
+        if cached is None or cached[0] is not self.content:
+            cached = (self.content, _scan_links(self.content))
+            self._links = cached
+        return cached[1]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serializable representation (includes links)."""
+        return {
+            "name": self.name,
+            "tags": self.tags,
+            "content": self.content,
+            "image_url": self.image_url,
+            "links": [link.to_dict() for link in self.links]
+        }
+
+
+@dataclass(**_DATACLASS_SLOTS)
 class Link:
     """Represents a story link."""
     display: str
@@ -65,20 +108,42 @@ class Link:
             return f"Link([[{self.target}]])"
         return f"Link([[{self.display}|{self.target}]])"
 
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serializable representation."""
+        return {
+            "display": self.display,
+            "target": self.target,
+            "setters": self.setters
+        }
+
 
-@dataclass
+@dataclass(**_DATACLASS_SLOTS)
 class ParseResult:
     """Result of parsing Twee content."""
     passages: Dict[str, Passage]
     story_init_vars: Dict[str, Any]
     test_setup_vars: Dict[str, Any]
     errors: List[str]
+    # Snapshot of passage names taken at construction, for O(1) existence checks
+    passage_names: FrozenSet[str] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.passage_names = frozenset(self.passages)
 
     def __repr__(self):
         return f"ParseResult({len(self.passages)} passages, {len(self.errors)} errors)"
 
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serializable representation."""
+        return {
+            "passages": {name: p.to_dict() for name, p in self.passages.items()},
+            "story_init_vars": self.story_init_vars,
+            "test_setup_vars": self.test_setup_vars,
+            "errors": self.errors
+        }
+
 
-@dataclass
+@dataclass(**_DATACLASS_SLOTS)
 class RenderResult:
     """Result of rendering a passage."""
     text: str
@@ -86,11 +151,21 @@ class RenderResult:
     variable_changes: Dict[str, Any]
     errors: List[str]
 
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serializable representation."""
+        return {
+            "text": self.text,
+            "links": [link.to_dict() for link in self.links],
+            "variable_changes": self.variable_changes,
+            "errors": self.errors
+        }
+
 
 # ============================================================================
 # Value Parsing & Type Inference
 # ============================================================================
 
+@functools.lru_cache(maxsize=1024)
 def parse_value(value_str: str) -> Union[int, float, str, bool]:
     """
     Parse value string with proper type inference.
@@ -112,26 +187,35 @@ def parse_value(value_str: str) -> Union[int, float, str, bool]:
         'hello'
     """
     value_str = value_str.strip()
+    if not value_str:
+        return value_str
+
+    # Dispatch on the first character so each literal tries only the
+    # conversions that could succeed
+    first = value_str[0]
 
     # String value (quoted)
-    if (value_str.startswith('"') and value_str.endswith('"')) or \
-       (value_str.startswith("'") and value_str.endswith("'")):
-        return value_str[1:-1]
+    if first in '"\'':
+        return value_str[1:-1] if value_str.endswith(first) else value_str
 
     # Boolean value
-    if value_str.lower() == 'true':
-        return True
-    if value_str.lower() == 'false':
-        return False
+    if first in 'tTfF':
+        lowered = value_str.lower()
+        if lowered == 'true':
+            return True
+        if lowered == 'false':
+            return False
+        return value_str
 
     # Numeric value
-    try:
-        if '.' in value_str:
-            return float(value_str)
-        else:
-            return int(value_str)
-    except ValueError:
-        pass
+    if first.isdigit() or first in '+-.':
+        try:
+            if '.' in value_str:
+                return float(value_str)
+            else:
+                return int(value_str)
+        except ValueError:
+            pass
 
     # Default to string (unquoted)
     return value_str
@@ -141,6 +225,22 @@ def parse_value(value_str: str) -> Union[int, float, str, bool]:
 # Expression Evaluator
 # ============================================================================
 
+def _layer_sizes(variables: Any) -> Tuple[int, ...]:
+    """
+    Size of each layer of a variable store.
+
+    A ChainMap's len() merges its maps, so its layers are measured one by
+    one; a plain dict is a single layer.
+
+    Args:
+        variables: Dict or ChainMap of variables
+
+    Returns:
+        Tuple of layer sizes
+    """
+    return tuple(map(len, getattr(variables, 'maps', (variables,))))
+
+
 class ExpressionEvaluator:
     """
     Evaluates Twee expressions with variables, operators, and functions.
@@ -173,8 +273,13 @@ class ExpressionEvaluator:
         Args:
             variables: Variable store (e.g., missionDict or editor state)
         """
-        self.variables = variables or {}
+        self.variables = variables if variables is not None else {}
         self.errors: List[str] = []
+        # Lowercased name -> actual key, for case-insensitive lookups; see
+        # _lowercase_keys (None until built, or after variables_changed())
+        self._lower_keys: Optional[Dict[str, str]] = None
+        self._lower_keys_source: Any = None
+        self._lower_keys_sizes: Tuple[int, ...] = ()
 
     def evaluate(self, expr: str) -> Any:
         """
@@ -187,18 +292,28 @@ class ExpressionEvaluator:
             Evaluated result
         """
         try:
-            # Normalize operators
-            normalized = self._normalize_expression(expr)
+            return _compile_expression(expr)(self._get_variable)
 
-            # Replace variables
-            resolved = self._resolve_variables(normalized)
+        except Exception as e:
+            self.errors.append(f"Expression error: {expr} - {str(e)}")
+            return None
 
-            # Handle functions
-            resolved = self._resolve_functions(resolved)
+    def evaluate_compiled(self, expr: str, compiled: '_Compiled') -> Any:
+        """
+        Evaluate an expression compiled ahead of time.
 
-            # Evaluate
-            result = eval(resolved, {"__builtins__": {}}, {})
-            return result
+        Lets compiled passages keep the compiled form of each <<if>> and
+        <<print>> instead of looking it up by text on every render.
+
+        Args:
+            expr: Expression string (for error messages)
+            compiled: _compile_expression(expr)
+
+        Returns:
+            Evaluated result
+        """
+        try:
+            return compiled(self._get_variable)
 
         except Exception as e:
             self.errors.append(f"Expression error: {expr} - {str(e)}")
@@ -219,45 +334,24 @@ class ExpressionEvaluator:
             return False
         return bool(result)
 
-    def _normalize_expression(self, expr: str) -> str:
+    @staticmethod
+    def _translate_expression(expr: str) -> str:
         """
-        Normalize text operators to symbols.
-
-        Args:
-            expr: Raw expression
-
-        Returns:
-            Normalized expression
-        """
-        result = expr
-
-        # Replace text operators with symbols (word boundaries)
-        for text_op, symbol_op in self.OPERATORS.items():
-            # Use word boundaries to avoid partial matches
-            pattern = r'\b' + text_op + r'\b'
-            result = re.sub(pattern, symbol_op, result)
-
-        return result
+        Translate a Twee expression to Python source in one tokenizing pass.
 
-    def _resolve_variables(self, expr: str) -> str:
-        """
-        Replace $VARIABLE references with values.
+        Text operators become symbols and each $NAME becomes a _v_NAME
+        identifier; values are not substituted into the source but looked
+        up when the compiled expression runs.
+        String literals are copied through untouched.
 
         Args:
-            expr: Expression with variables
+            expr: Raw expression
 
         Returns:
-            Expression with resolved values
+            Python expression source
         """
-        def replace_var(match):
-            var_name = match.group(1)
-            # Case-insensitive lookup
-            value = self._get_variable(var_name)
-            return repr(value)
-
-        # Match $VARNAME (letters, numbers, underscores)
-        pattern = r'\$([A-Za-z_][A-Za-z0-9_]*)'
-        return re.sub(pattern, replace_var, expr)
+        tokens, _ = _EXPRESSION_SCANNER.scan(expr)
+        return ''.join(tokens)
 
     def _get_variable(self, var_name: str) -> Any:
         """
@@ -269,114 +363,363 @@ class ExpressionEvaluator:
         Returns:
             Variable value or empty string if not found
         """
-        # Try exact match first
-        if var_name in self.variables:
+        # Try exact match first (one lookup; variables may be a ChainMap)
+        try:
             return self.variables[var_name]
+        except KeyError:
+            pass
 
         # Try case-insensitive match
-        for key, value in self.variables.items():
-            if key.lower() == var_name.lower():
-                return value
+        key = self._lowercase_keys().get(var_name.lower())
+        if key is not None:
+            try:
+                return self.variables[key]
+            except KeyError:
+                pass
 
         # Not found - return empty string (Twee 1.0 behavior)
         return ""
 
-    def _resolve_functions(self, expr: str) -> str:
+    def set_variable(self, var_name: str, value: Any) -> None:
         """
-        Replace function calls with their results.
+        Assign a variable, keeping the case-insensitive index current.
 
         Args:
-            expr: Expression with functions
-
-        Returns:
-            Expression with evaluated functions
+            var_name: Variable name (without $)
+            value: New value
         """
-        # either(...) function
-        expr = self._resolve_either(expr)
+        variables = self.variables
+        lower_keys = self._lower_keys
+        if lower_keys is None or variables is not self._lower_keys_source:
+            variables[var_name] = value
+            return
 
-        # random(...) function
-        expr = self._resolve_random(expr)
+        # Only carry the index over if nothing else touched the store since
+        # it was checked; otherwise leave it to be rebuilt
+        in_sync = _layer_sizes(variables) == self._lower_keys_sizes
+        variables[var_name] = value
+        if in_sync:
+            lower_keys.setdefault(var_name.lower(), var_name)
+            self._lower_keys_sizes = _layer_sizes(variables)
 
-        return expr
+    def variables_changed(self) -> None:
+        """
+        Drop the case-insensitive index after editing the store directly.
 
-    def _resolve_either(self, expr: str) -> str:
+        Keys added or removed directly are noticed without this; it is
+        needed when a key is replaced by another one and the size stays the
+        same. <<set>> writes go through set_variable and never need it.
         """
-        Resolve either(...) functions.
+        self._lower_keys = None
 
-        Args:
-            expr: Expression possibly containing either()
+    def _lowercase_keys(self) -> Dict[str, str]:
+        """
+        Map each lowercased variable name to the key it came from.
+
+        Built on the first case-insensitive lookup and kept current by
+        set_variable; it is rebuilt when the store is replaced, gains or
+        loses keys some other way, or variables_changed() is called. A
+        miss is one dict lookup, not a scan. When two keys differ only by
+        case the first one wins, as before.
 
         Returns:
-            Expression with either() resolved
+            Lowercased name -> variable key
         """
-        pattern = r'either\(([^)]+)\)'
+        variables = self.variables
+        sizes = _layer_sizes(variables)
+        if (self._lower_keys is None or variables is not self._lower_keys_source
+                or sizes != self._lower_keys_sizes):
+            lower_keys: Dict[str, str] = {}
+            for key in variables:
+                lower_keys.setdefault(key.lower(), key)
+            self._lower_keys = lower_keys
+            self._lower_keys_source = variables
+            self._lower_keys_sizes = sizes
+        return self._lower_keys
+
+
+# Translated expressions spell $VAR as this prefix + VAR
+_VARIABLE_PREFIX = '_v_'
+
+if sys.version_info >= (3, 8):
+    _CONSTANT_NODES: Tuple[type, ...] = (ast.Constant,)
+
+    def _constant_value(node: ast.AST) -> Any:
+        return node.value
+else:
+    _CONSTANT_NODES = (ast.Num, ast.Str, ast.NameConstant)
+
+    def _constant_value(node: ast.AST) -> Any:
+        if isinstance(node, ast.Num):
+            return node.n
+        if isinstance(node, ast.Str):
+            return node.s
+        return node.value
+
+# Python syntax an expression may use once text operators are normalized
+_ALLOWED_EXPRESSION_NODES = _CONSTANT_NODES + (
+    ast.Expression, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare,
+    ast.IfExp, ast.Name, ast.Load, ast.Call, ast.Tuple, ast.List,
+    ast.And, ast.Or, ast.Not, ast.UAdd, ast.USub,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+)
+
+_EXPRESSION_FUNCTIONS = ('either', 'random')
+
+# Expression tokens, each mapped to its Python spelling. Words glued to
+# digits (3is) stay intact, matching the old \b-delimited substitution.
+_EXPRESSION_SCANNER = re.Scanner([
+    (r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'', lambda s, t: t),
+    (r'\$[A-Za-z_][A-Za-z0-9_]*', lambda s, t: _VARIABLE_PREFIX + t[1:]),
+    (r'\d\w*', lambda s, t: t),
+    (r'[^\W\d]\w*', lambda s, t: ExpressionEvaluator.OPERATORS.get(t, t)),
+    (r'[^\w"\'$]+|[\s\S]', lambda s, t: t),
+])
+
+
+def _either(*choices: Any) -> Any:
+    """either(a, b, ...) - pick one argument at random."""
+    return random_module.choice(choices) if choices else ""
+
+
+def _random(min_val: Any, max_val: Any) -> str:
+    """random(min, max) - random integer, as a string so it concatenates."""
+    return str(random_module.randint(int(min_val), int(max_val)))
+
+
+_FUNCTIONS: Dict[str, Callable[..., Any]] = {"either": _either, "random": _random}
+
+_BINARY_OPERATORS: Dict[type, Callable[[Any, Any], Any]] = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+}
+_UNARY_OPERATORS: Dict[type, Callable[[Any], Any]] = {
+    ast.Not: operator.not_, ast.UAdd: operator.pos, ast.USub: operator.neg,
+}
+_COMPARE_OPERATORS: Dict[type, Callable[[Any, Any], Any]] = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+    ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Gt: operator.gt, ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b, ast.NotIn: lambda a, b: a not in b,
+}
+
+# A compiled expression: called with a variable getter (name -> value)
+_Compiled = Callable[[Callable[[str], Any]], Any]
+
+
+def _parse_expression(expr: str) -> ast.Expression:
+    """
+    Translate a Twee expression to Python and parse it.
 
-        def replace_either(match):
-            args_str = match.group(1)
-            # Split by comma, respecting quotes
-            args = self._split_args(args_str)
-            if args:
-                choice = random_module.choice(args)
-                return repr(eval(choice, {"__builtins__": {}}, {}))
-            return '""'
+    Args:
+        expr: Twee expression string
 
-        return re.sub(pattern, replace_either, expr)
+    Returns:
+        Expression AST, checked against the Twee subset
 
-    def _resolve_random(self, expr: str) -> str:
-        """
-        Resolve random(min, max) functions.
+    Raises:
+        SyntaxError: Expression is not valid
+        ValueError: Expression uses syntax outside the Twee subset
+    """
+    source = ExpressionEvaluator._translate_expression(expr).strip()
+    tree = ast.parse(source, mode='eval')
 
-        Args:
-            expr: Expression possibly containing random()
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_EXPRESSION_NODES):
+            raise ValueError(f"unsupported syntax: {type(node).__name__}")
+        if isinstance(node, ast.Name) and node.id.startswith('__'):
+            raise ValueError(f"unsupported name: {node.id}")
+        if isinstance(node, ast.Call):
+            if (not isinstance(node.func, ast.Name)
+                    or node.func.id not in _EXPRESSION_FUNCTIONS
+                    or node.keywords):
+                raise ValueError("unsupported function call")
+
+    return tree
 
-        Returns:
-            Expression with random() resolved
-        """
-        pattern = r'random\(([^,]+),\s*([^)]+)\)'
 
-        def replace_random(match):
-            min_val = int(eval(match.group(1), {"__builtins__": {}}, {}))
-            max_val = int(eval(match.group(2), {"__builtins__": {}}, {}))
-            result = random_module.randint(min_val, max_val)
-            # Return as string literal (quoted) so it can be concatenated with other strings
-            return f'"{result}"'
+@functools.lru_cache(maxsize=1024)
+def _compile_expression(expr: str) -> _Compiled:
+    """
+    Compile a Twee expression once into nested Python closures.
 
-        return re.sub(pattern, replace_random, expr)
+    The result is cached per expression string, so repeated evaluations
+    skip translation and parsing entirely, and running it is plain
+    function calls: no eval() frame, and variables are fetched straight
+    from the getter instead of through a mapping. Semantics are Python's
+    (and/or short-circuit and return an operand, chained comparisons).
 
-    def _split_args(self, args_str: str) -> List[str]:
-        """
-        Split function arguments by comma, respecting quotes.
+    Args:
+        expr: Twee expression string
 
-        Args:
-            args_str: Comma-separated arguments
+    Returns:
+        Function taking a variable getter and returning the value
 
-        Returns:
-            List of argument strings
-        """
-        args = []
-        current = []
-        in_quotes = False
-        quote_char = None
-
-        for char in args_str:
-            if char in ('"', "'") and not in_quotes:
-                in_quotes = True
-                quote_char = char
-                current.append(char)
-            elif char == quote_char and in_quotes:
-                in_quotes = False
-                quote_char = None
-                current.append(char)
-            elif char == ',' and not in_quotes:
-                args.append(''.join(current).strip())
-                current = []
+    Raises:
+        SyntaxError: Expression is not valid
+        ValueError: Expression uses syntax outside the Twee subset
+    """
+    return _build_expression(_parse_expression(expr).body)
+
+
+def _try_compile_expression(expr: str) -> Optional[_Compiled]:
+    """
+    Compile an expression for a passage node, if it compiles.
+
+    Args:
+        expr: Twee expression string
+
+    Returns:
+        Compiled expression, or None if it is invalid (the node then
+        evaluates it by text, which reports the error on every render)
+    """
+    try:
+        return _compile_expression(expr)
+    except Exception:
+        return None
+
+
+def _build_expression(node: ast.AST) -> _Compiled:
+    """
+    Build the closure for one (already validated) expression node.
+
+    Args:
+        node: Expression AST node
+
+    Returns:
+        Function taking a variable getter and returning the node's value
+    """
+    if isinstance(node, _CONSTANT_NODES):
+        value = _constant_value(node)
+        return lambda get: value
+
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name.startswith(_VARIABLE_PREFIX):
+            # Interned so the variables dict is hit by identity
+            var_name = sys.intern(name[len(_VARIABLE_PREFIX):])
+            return lambda get: get(var_name)
+        if name in _FUNCTIONS:
+            function = _FUNCTIONS[name]
+            return lambda get: function
+
+        def undefined(get: Callable[[str], Any]) -> Any:
+            raise NameError(f"name '{name}' is not defined")
+        return undefined
+
+    if isinstance(node, ast.BoolOp):
+        values = [_build_expression(value) for value in node.values]
+        result = values[0]
+        for right in values[1:]:
+            if isinstance(node.op, ast.And):
+                result = (lambda l, r: lambda get: l(get) and r(get))(result, right)
             else:
-                current.append(char)
+                result = (lambda l, r: lambda get: l(get) or r(get))(result, right)
+        return result
+
+    if isinstance(node, ast.BinOp):
+        binary = _BINARY_OPERATORS[type(node.op)]
+        left, right = _build_expression(node.left), _build_expression(node.right)
+        return lambda get: binary(left(get), right(get))
+
+    if isinstance(node, ast.UnaryOp):
+        unary = _UNARY_OPERATORS[type(node.op)]
+        operand = _build_expression(node.operand)
+        return lambda get: unary(operand(get))
+
+    if isinstance(node, ast.Compare):
+        first = _build_expression(node.left)
+        steps = [(_COMPARE_OPERATORS[type(op)], _build_expression(comparator))
+                 for op, comparator in zip(node.ops, node.comparators)]
+        if len(steps) == 1:
+            compare, second = steps[0]
+            right = node.comparators[0]
+            if isinstance(right, _CONSTANT_NODES):
+                # $VAR op literal, the usual condition: one lookup, one compare
+                value = _constant_value(right)
+                left = node.left
+                if isinstance(left, ast.Name) and left.id.startswith(_VARIABLE_PREFIX):
+                    var_name = sys.intern(left.id[len(_VARIABLE_PREFIX):])
+                    return lambda get: compare(get(var_name), value)
+                return lambda get: compare(first(get), value)
+            return lambda get: compare(first(get), second(get))
+
+        def chain(get: Callable[[str], Any]) -> Any:
+            left = first(get)
+            for compare, next_operand in steps:
+                right = next_operand(get)
+                result = compare(left, right)
+                if not result:
+                    return result
+                left = right
+            return result
+        return chain
+
+    if isinstance(node, ast.IfExp):
+        test, body, orelse = (_build_expression(node.test), _build_expression(node.body),
+                              _build_expression(node.orelse))
+        return lambda get: body(get) if test(get) else orelse(get)
+
+    if isinstance(node, ast.Call):
+        function_node = _build_expression(node.func)
+        arguments = [_build_expression(arg) for arg in node.args]
+        return lambda get: function_node(get)(*[arg(get) for arg in arguments])
+
+    if isinstance(node, (ast.List, ast.Tuple)):
+        container = list if isinstance(node, ast.List) else tuple
+        items = [_build_expression(item) for item in node.elts]
+        return lambda get: container([item(get) for item in items])
+
+    raise ValueError(f"unsupported syntax: {type(node).__name__}")
+
+
+def _no_variables(name: str) -> Any:
+    """Variable getter for constant expressions (never called)."""
+    raise NameError(name)
 
-        if current:
-            args.append(''.join(current).strip())
 
-        return args
+# Operators whose result size is not bounded by the expression's length
+_UNBOUNDED_OPERATORS = (ast.Mult, ast.Mod)
+
+# Returned by _literal_value for anything that is not a constant
+_NOT_LITERAL = object()
+
+
+@functools.lru_cache(maxsize=1024)
+def _literal_value(expr: str) -> Any:
+    """
+    Value of an expression that is a constant: a plain string or number
+    literal, or an expression using only literals ("a" + "b", 3 is 4).
+
+    Lets <<set>> and <<print>> use constants without going through the
+    evaluator; constant expressions are evaluated once, here. Only
+    immutable scalars count; a cached list would be shared by every <<set>>
+    that assigns it. Folding happens when a passage is compiled, even for
+    macros in branches that never run, so * and % (which can build
+    arbitrarily large strings, e.g. "a" * 100000000) are not folded.
+
+    Args:
+        expr: Twee expression string
+
+    Returns:
+        The constant's value, or _NOT_LITERAL
+    """
+    try:
+        value = ast.literal_eval(expr)
+    except Exception:
+        try:
+            # Any name is a variable or either()/random(): not constant
+            tree = _parse_expression(expr)
+            for node in ast.walk(tree):
+                if isinstance(node, ast.Name) or isinstance(node, _UNBOUNDED_OPERATORS):
+                    return _NOT_LITERAL
+            value = _compile_expression(expr)(_no_variables)
+        except Exception:
+            # Invalid or failing expressions are left to the evaluator,
+            # which reports the error each time it runs
+            return _NOT_LITERAL
+    return value if type(value) in (str, int, float, bool) else _NOT_LITERAL
 
 
 # ============================================================================
@@ -388,6 +731,9 @@ class MacroProcessor:
     Processes Twee macros (<<set>>, <<print>>, <<if>>, etc.).
     """
 
+    # $VAR op value (where op is =, to, +=, -=, *=, /=)
+    ASSIGNMENT_PATTERN = re.compile(r'\$([A-Za-z_][A-Za-z0-9_]*)\s+(=|to|\+=|-=|\*=|/=)\s+(.+)')
+
     def __init__(self, variables: Dict[str, Any]):
         """
         Initialize macro processor.
@@ -414,41 +760,63 @@ class MacroProcessor:
         Args:
             content: Macro content (between << and >>)
         """
-        # Remove 'set' keyword
-        assignment = content[3:].strip()
-
-        # Match: $VAR op value (where op is =, to, +=, -=, *=, /=)
-        match = re.match(r'\$([A-Za-z_][A-Za-z0-9_]*)\s+(=|to|\+=|-=|\*=|/=)\s+(.+)', assignment)
-        if not match:
+        assignment = self._parse_assignment(content)
+        if assignment is None:
             self.errors.append(f"Invalid <<set>> syntax: {content}")
             return
 
-        var_name = match.group(1)
-        operator = match.group(2)
-        value_expr = match.group(3).strip()
+        var_name, operator, value_expr, new_value = assignment
 
-        # Evaluate expression
-        new_value = self.evaluator.evaluate(value_expr)
+        # Evaluate expression (plain literals were resolved when parsed)
+        if new_value is _NOT_LITERAL:
+            new_value = self.evaluator.evaluate(value_expr)
 
         # Apply operator
         if operator in ('=', 'to'):
-            self.variables[var_name] = new_value
+            self.evaluator.set_variable(var_name, new_value)
         elif operator == '+=':
             current = self.variables.get(var_name, 0)
-            self.variables[var_name] = current + new_value
+            self.evaluator.set_variable(var_name, current + new_value)
         elif operator == '-=':
             current = self.variables.get(var_name, 0)
-            self.variables[var_name] = current - new_value
+            self.evaluator.set_variable(var_name, current - new_value)
         elif operator == '*=':
             current = self.variables.get(var_name, 1)
-            self.variables[var_name] = current * new_value
+            self.evaluator.set_variable(var_name, current * new_value)
         elif operator == '/=':
             current = self.variables.get(var_name, 1)
             if new_value != 0:
-                self.variables[var_name] = current / new_value
+                self.evaluator.set_variable(var_name, current / new_value)
             else:
                 self.errors.append(f"Division by zero in: {content}")
 
+    @classmethod
+    @functools.lru_cache(maxsize=1024)
+    def _parse_assignment(cls, content: str) -> Optional[Tuple[str, str, str, Any]]:
+        """
+        Split <<set>> macro content into its parts, once per distinct macro.
+
+        Args:
+            content: Macro content (between << and >>)
+
+        Returns:
+            (var_name, operator, value_expr, literal) tuple, where literal
+            is the value of a plain literal expression or _NOT_LITERAL; None
+            if the syntax is invalid
+        """
+        # Remove 'set' keyword
+        assignment = content[3:].strip()
+
+        # Match: $VAR op value (where op is =, to, +=, -=, *=, /=)
+        match = cls.ASSIGNMENT_PATTERN.match(assignment)
+        if not match:
+            return None
+
+        # Interned: the same names key every variables dict for the story
+        var_name = sys.intern(match.group(1))
+        value_expr = match.group(3).strip()
+        return var_name, match.group(2), value_expr, _literal_value(value_expr)
+
     def process_print_macro(self, content: str) -> str:
         """
         Process <<print>> macro.
@@ -480,10 +848,419 @@ class MacroProcessor:
         return self.evaluator.evaluate_condition(condition)
 
 
+# ============================================================================
+# Compiled Passages
+# ============================================================================
+
+class _RenderState:
+    """Mutable state threaded through a single render pass."""
+
+    def __init__(self,
+                 parser: 'TweeParser',
+                 processor: MacroProcessor,
+                 mode: ExecutionMode,
+                 passages: Optional[Dict[str, Passage]],
+                 display_stack: List[str],
+                 errors: List[str],
+                 lower_names: Dict[str, str]):
+        self.parser = parser
+        self.processor = processor
+        self.mode = mode
+        self.passages = passages
+        self.display_stack = display_stack
+        self.errors = errors
+        # Lowercased passage name -> name, filled on the first
+        # case-insensitive <<display>> lookup and shared by nested displays
+        self.lower_names = lower_names
+        self.parts: List[str] = []
+
+
+class _Node:
+    """Base class for compiled passage nodes."""
+
+    __slots__ = ()
+
+    def render(self, state: _RenderState) -> None:
+        raise NotImplementedError
+
+
+class _TextNode(_Node):
+    """Literal text (already collapsed if inside <<nobr>>)."""
+
+    __slots__ = ('text',)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def render(self, state: _RenderState) -> None:
+        state.parts.append(self.text)
+
+
+class _SetNode(_Node):
+    """<<set>> macro."""
+
+    __slots__ = ('macro',)
+
+    def __init__(self, macro: str):
+        self.macro = macro
+
+    def render(self, state: _RenderState) -> None:
+        state.processor.process_set_macro(self.macro)
+
+
+class _SetConstantNode(_Node):
+    """<<set $VAR to constant>>; stores the value without any parsing."""
+
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name: str, value: Any):
+        self.name = name
+        self.value = value
+
+    def render(self, state: _RenderState) -> None:
+        state.processor.evaluator.set_variable(self.name, self.value)
+
+
+class _PrintNode(_Node):
+    """<<print>> macro."""
+
+    __slots__ = ('macro', 'expr', 'compiled', 'nobr')
+
+    def __init__(self, macro: str, nobr: bool):
+        self.macro = macro
+        self.expr = macro[5:].strip()
+        self.compiled = _try_compile_expression(self.expr)
+        self.nobr = nobr
+
+    def render(self, state: _RenderState) -> None:
+        if self.compiled is None:
+            text = state.processor.process_print_macro(self.macro)
+        else:
+            value = state.processor.evaluator.evaluate_compiled(self.expr, self.compiled)
+            text = str(value) if value is not None else ""
+        if self.nobr:
+            text = text.replace('\n', ' ')
+        state.parts.append(text)
+
+
+class _PrintVariableNode(_Node):
+    """<<print $VAR>> of a single variable; no expression to evaluate."""
+
+    __slots__ = ('name', 'nobr')
+
+    def __init__(self, name: str, nobr: bool):
+        self.name = name
+        self.nobr = nobr
+
+    def render(self, state: _RenderState) -> None:
+        value = state.processor.evaluator._get_variable(self.name)
+        text = str(value) if value is not None else ""
+        if self.nobr:
+            text = text.replace('\n', ' ')
+        state.parts.append(text)
+
+
+class _IfNode(_Node):
+    """
+    <<if>>/<<elseif>>/<<else>> chain.
+
+    Branches are (condition, compiled, body) triples in source order;
+    <<else>> has a condition of None. The first branch whose condition
+    holds is rendered.
+    """
+
+    __slots__ = ('branches',)
+
+    def __init__(self, condition: str):
+        self.branches: List[Tuple[Optional[str], Optional[_Compiled], List[_Node]]] = []
+        self.add_branch(condition)
+
+    def add_branch(self, condition: Optional[str]) -> List[_Node]:
+        """
+        Start the next <<elseif>>/<<else>> branch.
+
+        Args:
+            condition: Branch condition, or None for <<else>>
+
+        Returns:
+            The branch's (empty) body list
+        """
+        compiled = _try_compile_expression(condition) if condition is not None else None
+        body: List[_Node] = []
+        self.branches.append((condition, compiled, body))
+        return body
+
+    def render(self, state: _RenderState) -> None:
+        for condition, compiled, body in self.branches:
+            if condition is not None:
+                if compiled is None:
+                    holds = state.processor.evaluate_condition(condition)
+                else:
+                    holds = state.processor.evaluator.evaluate_compiled(condition, compiled)
+                if not holds:
+                    continue
+            for node in body:
+                node.render(state)
+            return
+
+
+class _DisplayNode(_Node):
+    """
+    <<display "PASSAGE_NAME">> macro.
+
+    Renders the named passage inline with the caller's variables, so it can
+    have its own macros and conditionals. Circular references are reported
+    as errors instead of recursing forever.
+    """
+
+    __slots__ = ('name', 'source', 'nobr')
+
+    def __init__(self, name: str, source: str, nobr: bool):
+        self.name = name
+        self.source = source
+        self.nobr = nobr
+
+    def render(self, state: _RenderState) -> None:
+        text = self._expand(state)
+        if self.nobr:
+            text = text.replace('\n', ' ')
+        state.parts.append(text)
+
+    def _expand(self, state: _RenderState) -> str:
+        if not state.passages:
+            return self.source
+
+        passage_name = self.name
+        display_stack = state.display_stack
+        errors = state.errors
+
+        # Check for circular reference
+        if passage_name in display_stack:
+            error_msg = f"Circular <<display>> reference detected: {' -> '.join(display_stack + [passage_name])}"
+            errors.append(error_msg)
+            return f"[ERROR: {error_msg}]"
+
+        # Look up passage: exact name first, then case-insensitive
+        passages = state.passages
+        target_passage = passages.get(passage_name)
+        if target_passage is None:
+            lower_names = state.lower_names
+            if not lower_names:
+                # When two names differ only by case the first one wins
+                for name in passages:
+                    lower_names.setdefault(name.lower(), name)
+            name = lower_names.get(passage_name.lower())
+            if name is not None:
+                target_passage = passages.get(name)
+
+        if not target_passage:
+            error_msg = f"<<display>> passage not found: {passage_name}"
+            errors.append(error_msg)
+            return f"[ERROR: {error_msg}]"
+
+        # Recursively render the displayed passage; the stack is shared
+        # down the recursion and restored on the way out
+        display_stack.append(passage_name)
+        try:
+            text, nested_errors = state.parser._render_text(
+                target_passage,
+                state.processor,
+                state.mode,
+                state.passages,
+                display_stack,
+                state.lower_names
+            )
+        finally:
+            display_stack.pop()
+
+        # Collect any errors from the nested render
+        errors.extend(nested_errors)
+
+        return text.strip()
+
+
+def _compile_passage(text: str) -> List[_Node]:
+    """
+    Compile passage text into a tree of render nodes.
+
+    Macros are matched once here; rendering then just walks the tree.
+    <<nobr>> regions are resolved at compile time (like the macro itself,
+    they apply regardless of which branch is taken). Stray <<elseif>>,
+    <<else>> and <<endif>> tags are kept as literal text.
+
+    Args:
+        text: Passage content
+
+    Returns:
+        Top-level node list
+    """
+    root: List[_Node] = []
+    body = root
+    # One (if_node, enclosing_body) entry per open <<if>>
+    open_ifs: List[Tuple[_IfNode, List[_Node]]] = []
+    nobr = 0
+    pos = 0
+
+    def add_text(literal: str) -> None:
+        if literal:
+            body.append(_TextNode(literal.replace('\n', ' ') if nobr else literal))
+
+    for match in TweeParser.MACRO_PATTERN.finditer(text):
+        add_text(text[pos:match.start()])
+        pos = match.end()
+        kind = match.lastgroup
+
+        if kind == 'set':
+            macro = match.group('set')
+            assignment = MacroProcessor._parse_assignment(macro)
+            if (assignment is not None and assignment[1] in ('=', 'to')
+                    and assignment[3] is not _NOT_LITERAL):
+                body.append(_SetConstantNode(assignment[0], assignment[3]))
+            else:
+                body.append(_SetNode(macro))
+        elif kind == 'print':
+            macro = match.group('print')
+            variable = TweeParser.PRINT_VARIABLE_PATTERN.match(macro)
+            if variable:
+                body.append(_PrintVariableNode(sys.intern(variable.group(1)), bool(nobr)))
+            else:
+                literal = _literal_value(macro[5:].strip())
+                if literal is not _NOT_LITERAL:
+                    # Constant output is folded into the surrounding text
+                    add_text(str(literal))
+                else:
+                    body.append(_PrintNode(macro, bool(nobr)))
+        elif kind == 'if':
+            node = _IfNode(match.group('if'))
+            body.append(node)
+            open_ifs.append((node, body))
+            body = node.branches[0][2]
+        elif kind in ('elseif', 'else'):
+            if not open_ifs:
+                add_text(match.group(0))
+                continue
+            condition = match.group('elseif') if kind == 'elseif' else None
+            body = open_ifs[-1][0].add_branch(condition)
+        elif kind == 'endif':
+            if not open_ifs:
+                add_text(match.group(0))
+                continue
+            body = open_ifs.pop()[1]
+        elif kind == 'nobr':
+            nobr += 1
+        elif kind == 'endnobr':
+            if nobr:
+                nobr -= 1
+        elif kind == 'display':
+            body.append(_DisplayNode(match.group('display').strip(),
+                                     match.group(0), bool(nobr)))
+
+    add_text(text[pos:])
+    return root
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_test_setup(text: str) -> List[Tuple[str, Any]]:
+    """
+    Compile TestSetup passage text into a flat operation list.
+
+    Each op is ('set', [macro, ...]) for the <<set>> macros between two
+    conditional tags, or (tag, condition) for an <<if>>/<<elseif>>
+    (condition string) or <<else>>/<<endif>> (None). Running the ops only
+    folds over the tags, so re-running a TestSetup never rescans its text.
+
+    Args:
+        text: TestSetup passage content
+
+    Returns:
+        Operation list, in source order
+    """
+    ops: List[Tuple[str, Any]] = []
+    pos = 0
+
+    for match in TweeParser.CONDITIONAL_PATTERN.finditer(text):
+        sets = TweeParser.SET_PATTERN.findall(text, pos, match.start())
+        if sets:
+            ops.append(('set', sets))
+        pos = match.end()
+        kind = match.lastgroup
+        ops.append((kind, match.group(kind) if kind in ('if', 'elseif') else None))
+
+    sets = TweeParser.SET_PATTERN.findall(text, pos)
+    if sets:
+        ops.append(('set', sets))
+    return ops
+
+
 # ============================================================================
 # Core Parser
 # ============================================================================
 
+def _passage_bounds(buf: Any, marker: Any) -> Iterator[Tuple[int, int]]:
+    """
+    Find the (start, end) span of each passage section in buf.
+
+    Works on str, bytes and mmap alike (marker must match the type).
+
+    Args:
+        buf: Story text or buffer
+        marker: Newline followed by the passage marker ('\\n::' / b'\\n::')
+
+    Yields:
+        (start, end) of each section, header included. The first span is
+        whatever precedes the first marker line; it is only a passage if
+        it starts with '::' once stripped (leading whitespace is allowed)
+    """
+    start = 0
+    while start >= 0:
+        next_marker = buf.find(marker, start)
+        end = len(buf) if next_marker < 0 else next_marker + 1
+        yield start, end
+        start = next_marker + 1 if next_marker >= 0 else -1
+
+
+def _scan_links(text: str) -> List[Link]:
+    """
+    Scan text for [[Target]] and [[Display|Target]] links.
+
+    Args:
+        text: Passage or rendered text
+
+    Returns:
+        List of Link objects in document order; targets are interned so
+        they share storage with passage names and hit passage dicts by
+        identity
+    """
+    links = []
+
+    for match in TweeParser.LINK_PATTERN.finditer(text):
+        if match.group(2):
+            # [[Display|Target]] format
+            display = match.group(1).strip()
+            target = sys.intern(match.group(2).strip())
+        else:
+            # [[Target]] format
+            target = sys.intern(match.group(1).strip())
+            display = target
+
+        links.append(Link(display=display, target=target))
+
+    return links
+
+
+def _copy_links(links: List[Link]) -> List[Link]:
+    """
+    Copy cached links for a caller that may mutate them.
+
+    Args:
+        links: Links shared through Passage.links
+
+    Returns:
+        New Link objects (with their own setters lists) in the same order
+    """
+    return [Link(link.display, link.target, list(link.setters)) for link in links]
+
+
 class TweeParser:
     """
     Twee 1.0 parser with full macro and expression support.
@@ -496,9 +1273,50 @@ class TweeParser:
 
     # Regex patterns for Twee syntax
     PASSAGE_PATTERN = re.compile(r'^::([^[\n]+)(?:\[([^\]]+)\])?\s*$', re.MULTILINE)
+    HEADER_PATTERN = re.compile(r'^::\s*([^[\n]+?)(?:\s*\[([^\]]+)\])?\s*$')
     LINK_PATTERN = re.compile(r'\[\[([^\]|]+)(?:\|([^\]]+))?\]\]')
     IMAGE_PATTERN = re.compile(r'\[img\[([^\]]+)\]\]')
 
+    # Passages whose variables are extracted at parse time
+    SPECIAL_PASSAGES = ('StoryInit', 'TestSetup')
+
+    # <<set>> macros (StoryInit/TestSetup extraction)
+    SET_PATTERN = re.compile(r'<<(set\s+.+?)>>')
+
+    # A condition: one or more characters (newlines included) up to the
+    # first '>>'. Written as an unrolled loop so the lookahead only runs at
+    # '>' characters, not at every position like (?:(?!>>)[\s\S])+
+    _CONDITION = r'(?=[^>]|>(?!>))[^>]*(?:>(?!>)[^>]*)*'
+
+    # Conditional tags; TestSetup extraction folds them to find live spans
+    CONDITIONAL_PATTERN = re.compile(
+        r'<<(?:'
+        r'if\s+(?P<if>' + _CONDITION + r')'
+        r'|elseif\s+(?P<elseif>' + _CONDITION + r')'
+        r'|(?P<else>else)'
+        r'|(?P<endif>endif|/if)'
+        r')>>'
+    )
+
+    # All render-time macros fused into one alternation; the named group that
+    # matched (match.lastgroup) selects the node type
+    MACRO_PATTERN = re.compile(
+        r'<<(?:'
+        r'(?P<set>set\s+.+?)'
+        r'|(?P<print>print\s+.+?)'
+        r'|if\s+(?P<if>' + _CONDITION + r')'
+        r'|elseif\s+(?P<elseif>' + _CONDITION + r')'
+        r'|(?P<else>else)'
+        r'|(?P<endif>endif|/if)'
+        r'|(?P<nobr>nobr)'
+        r'|(?P<endnobr>endnobr)'
+        r'|(?i:display)\s+["\'](?P<display>[^"\']+)["\']\s*'
+        r')>>'
+    )
+
+    # <<print>> of a bare $VAR (compiled to a direct variable lookup)
+    PRINT_VARIABLE_PATTERN = re.compile(r'print\s+\$([A-Za-z_][A-Za-z0-9_]*)\s*$')
+
     def __init__(self, scope_mode: VariableScope = VariableScope.GLOBAL):
         """
         Initialize parser.
@@ -507,105 +1325,217 @@ class TweeParser:
             scope_mode: Variable scoping strategy (GLOBAL or USERNAME_PREFIXED)
         """
         self.scope_mode = scope_mode
+        # Errors from the most recent parse (also returned on ParseResult);
+        # parsing itself keeps all working state local, so one parser can
+        # be shared and reused
         self.errors: List[str] = []
 
-    def parse_twee(self, content: str) -> ParseResult:
+    @classmethod
+    def clear_cache(cls) -> None:
+        """
+        Drop the per-section parse cache.
+
+        Parsed passages are cached by their source text (see _passage_fields)
+        so a reparse only redoes the passages that changed; long-running
+        callers that are done with a story can release that text here.
+        """
+        cls._passage_fields.cache_clear()
+
+    def parse_twee(self, content: str, vars_only: bool = False) -> ParseResult:
         """
         Parse Twee content into story structure.
 
         Args:
             content: Raw Twee content (entire file as string)
+            vars_only: Only parse StoryInit and TestSetup (for callers that
+                just need story_init_vars/test_setup_vars); passages then
+                holds those two alone
 
         Returns:
             ParseResult with passages, story_init_vars, test_setup_vars, and errors
         """
-        self.errors = []
-        passages: Dict[str, Passage] = {}
+        # Sections are sliced out one at a time, so no list of every
+        # section (a second copy of the story) is built
+        return self._parse_sections((
+            content[start:end].strip()
+            for start, end in _passage_bounds(content, '\n::')
+        ), vars_only)
+
+    def parse_twee_file(self, path: Union[str, os.PathLike],
+                        vars_only: bool = False) -> ParseResult:
+        """
+        Parse a Twee file.
+
+        The file is memory-mapped and each passage is decoded (UTF-8) on its
+        own, so the whole story is never held as one big string. Files with
+        CR line endings are read in text mode instead, to get the same
+        newline translation as open(path).read().
 
-        # Split content into passages
-        passage_sections = self._split_into_passages(content)
+        Args:
+            path: Path to the .twee file
+            vars_only: Only parse StoryInit and TestSetup (see parse_twee)
+
+        Returns:
+            ParseResult with passages, story_init_vars, test_setup_vars, and errors
+        """
+        with open(path, 'rb') as f:
+            if not f.seek(0, 2):
+                # mmap cannot map an empty file
+                return self.parse_twee('', vars_only)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data.find(b'\r') < 0:
+                    return self._parse_sections([
+                        data[start:end].decode('utf-8').strip()
+                        for start, end in _passage_bounds(data, b'\n::')
+                    ], vars_only)
+
+        with open(path, 'r', encoding='utf-8') as f:
+            return self.parse_twee(f.read(), vars_only)
+
+    def _parse_sections(self, passage_sections: Iterable[str],
+                        vars_only: bool = False) -> ParseResult:
+        """
+        Build a ParseResult from split passage sections.
+
+        Args:
+            passage_sections: Stripped passage texts including their ::
+                headers, consumed once; sections not starting with :: are
+                skipped
+            vars_only: Skip every passage but StoryInit and TestSetup
 
-        # Parse each passage
+        Returns:
+            ParseResult with passages, story_init_vars, test_setup_vars, and errors
+        """
+        errors: List[str] = []
+        passages: Dict[str, Passage] = {}
+
+        # Parse each passage; text before the first header is not one
         for section in passage_sections:
-            passage = self._parse_passage(section)
-            if passage:
+            if not section.startswith('::'):
+                continue
+            if vars_only:
+                # Cheap look at the header line; the name is checked properly
+                # once the passage is parsed
+                end = section.find('\n')
+                header = section[:end] if end >= 0 else section
+                if 'StoryInit' not in header and 'TestSetup' not in header:
+                    continue
+            passage = self._parse_passage(section, errors)
+            if passage and (not vars_only or passage.name in self.SPECIAL_PASSAGES):
                 passages[passage.name] = passage
 
         # Extract special passages
         story_init_vars = self._extract_story_init(passages.get('StoryInit'))
         test_setup_vars = self._extract_test_setup(passages.get('TestSetup'))
 
-        return ParseResult(
+        result = ParseResult(
             passages=passages,
             story_init_vars=story_init_vars,
             test_setup_vars=test_setup_vars,
-            errors=self.errors.copy()
+            errors=errors
         )
+        self.errors = errors.copy()
+        return result
 
-    def _split_into_passages(self, content: str) -> List[str]:
+    def _parse_passage(self, section: str, errors: List[str]) -> Optional[Passage]:
         """
-        Split Twee content into individual passage sections.
+        Parse a single passage section.
 
         Args:
-            content: Raw Twee content
+            section: Passage text including :: header
+            errors: Error list for the current parse
 
         Returns:
-            List of passage sections (including header and content)
+            Passage object or None if parsing fails
         """
-        # Split on passage markers (:: at start of line)
-        sections = re.split(r'^(?=::)', content, flags=re.MULTILINE)
+        fields = self._passage_fields(section)
+        if isinstance(fields, str):
+            errors.append(fields)
+            return None
 
-        # Filter out empty sections
-        return [s.strip() for s in sections if s.strip() and s.strip().startswith('::')]
+        name, tags, content, raw_content, image_url = fields
+        return Passage(
+            name=name,
+            tags=list(tags),
+            content=content,
+            raw_content=raw_content,
+            image_url=image_url
+        )
 
-    def _parse_passage(self, section: str) -> Optional[Passage]:
+    @classmethod
+    @functools.lru_cache(maxsize=256)
+    def _passage_fields(cls, section: str) -> Union[Tuple[str, Tuple[str, ...], str, str, Optional[str]], str]:
         """
-        Parse a single passage section.
+        Parse a passage section into the values of its Passage fields.
+
+        Cached per section text, so reparsing a story only does the work for
+        passages that changed. The cache keeps that text alive, so it is kept
+        small and can be emptied with clear_cache(). Callers may mutate
+        Passages, so each parse still builds fresh ones from these
+        (immutable) values.
 
         Args:
             section: Passage text including :: header
 
         Returns:
-            Passage object or None if parsing fails
+            (name, tags, content, raw_content, image_url) tuple, or the error
+            message if the header is invalid
         """
-        lines = section.split('\n', 1)
-        if not lines:
-            return None
-
-        header = lines[0]
-        content = lines[1] if len(lines) > 1 else ""
+        header, _, content = section.partition('\n')
 
         # Parse header: :: PassageName [tag1, tag2]
-        match = re.match(r'^::\s*([^[\n]+?)(?:\s*\[([^\]]+)\])?\s*$', header)
-        if not match:
-            self.errors.append(f"Invalid passage header: {header}")
-            return None
+        parsed_header = cls._parse_header(header)
+        if not parsed_header:
+            return f"Invalid passage header: {header}"
 
-        name = match.group(1).strip()
-        tags_str = match.group(2)
+        name, tags_str = parsed_header
+        name = sys.intern(name)
 
-        # Parse tags
-        tags = []
+        # Parse tags (interned: a story reuses a handful of tags everywhere)
+        tags: Tuple[str, ...] = ()
         if tags_str:
-            tags = [tag.strip() for tag in tags_str.split(',') if tag.strip()]
+            tags = tuple(sys.intern(tag.strip()) for tag in tags_str.split(',') if tag.strip())
 
         # Extract image URL if present and remove image tag from content
-        image_url = self._extract_image_url(content)
+        image_url = cls._extract_image_url(content)
 
         # Remove [img[url]] tag from content for display
         content_without_image = content
         if image_url:
-            content_without_image = self.IMAGE_PATTERN.sub('', content).strip()
+            content_without_image = cls.IMAGE_PATTERN.sub('', content).strip()
 
-        return Passage(
-            name=name,
-            tags=tags,
-            content=content_without_image,
-            raw_content=content.strip(),
-            image_url=image_url
-        )
+        return name, tags, content_without_image, content.strip(), image_url
+
+    @classmethod
+    def _parse_header(cls, header: str) -> Optional[Tuple[str, Optional[str]]]:
+        """
+        Split a passage header into name and raw tag string.
+
+        Well-formed headers are handled with str.partition; anything unusual
+        falls back to HEADER_PATTERN so malformed input is judged the same way.
+
+        Args:
+            header: Header line including the leading ::
+
+        Returns:
+            (name, tags_str) tuple, or None if the header is invalid
+        """
+        name_part, bracket, tag_part = header[2:].partition('[')
+        name = name_part.strip()
+        if name and '\n' not in header:
+            if not bracket:
+                return name, None
+            tag_part = tag_part.rstrip()
+            if tag_part.endswith(']') and ']' not in tag_part[:-1] and len(tag_part) > 1:
+                return name, tag_part[:-1]
+
+        match = cls.HEADER_PATTERN.match(header)
+        if not match:
+            return None
+        return match.group(1).strip(), match.group(2)
 
-    def _extract_image_url(self, content: str) -> Optional[str]:
+    @classmethod
+    def _extract_image_url(cls, content: str) -> Optional[str]:
         """
         Extract image URL from [img[...]] syntax.
 
@@ -615,7 +1545,12 @@ class TweeParser:
         Returns:
             Image URL or None
         """
-        match = self.IMAGE_PATTERN.search(content)
+        # Most passages have no image; the substring probe rejects them
+        # faster than a regex search over the whole body
+        if '[img[' not in content:
+            return None
+
+        match = cls.IMAGE_PATTERN.search(content)
         return match.group(1) if match else None
 
     def _extract_story_init(self, passage: Optional[Passage]) -> Dict[str, Any]:
@@ -635,13 +1570,10 @@ class TweeParser:
         variables = {}
         processor = MacroProcessor(variables)
 
-        # Find all <<set>> macros
-        set_pattern = re.compile(r'<<(set\s+.+?)>>')
-        for match in set_pattern.finditer(passage.content):
-            macro_content = match.group(1)
+        # Find all <<set>> macros; the processor writes into variables in
+        # place, so each macro sees the ones before it
+        for macro_content in self.SET_PATTERN.findall(passage.content):
             processor.process_set_macro(macro_content)
-            # Update evaluator with new variables so subsequent macros can reference them
-            processor.evaluator.variables = variables
 
         return variables
 
@@ -663,49 +1595,94 @@ class TweeParser:
         if not passage:
             return {}
 
-        content = passage.content
-        variables = {}
+        return self._run_test_setup(_compile_test_setup(passage.content))
 
-        # PASS 1: Extract top-level <<set>> statements (before first <<if>>)
-        # Find position of first <<if>>
-        if_match = re.search(r'<<if\s+', content)
-        if if_match:
-            top_level_content = content[:if_match.start()]
-        else:
-            top_level_content = content
+    def rerun_test_setup(self, result: ParseResult,
+                         overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Run a parsed story's TestSetup again, optionally with overrides.
 
-        # Extract all <<set>> from top-level
-        processor = MacroProcessor(variables)
-        set_pattern = re.compile(r'<<(set\s+.+?)>>')
-        for match in set_pattern.finditer(top_level_content):
-            macro_content = match.group(1)
-            processor.process_set_macro(macro_content)
+        The passage is not reparsed: its compiled operations are reused,
+        so sweeping a value (e.g. every $SCENARIO) costs one TestSetup run
+        per value.
 
-        # PASS 2 & 3: Evaluate conditionals and extract variables from matched branch
-        if if_match:
-            # Process conditionals to get the evaluated branch content
-            conditional_content = content[if_match.start():]
+        Args:
+            result: ParseResult holding the TestSetup passage
+            overrides: Variables to force once the top-level <<set>>
+                statements have run (Pass 1), so conditions see them;
+                <<set>>s in taken branches can still change them
 
-            # Create a processor with Pass 1 variables
-            processor = MacroProcessor(variables)
+        Returns:
+            Dictionary of test variables (like ParseResult.test_setup_vars)
+        """
+        passage = result.passages.get('TestSetup')
+        if not passage:
+            return dict(overrides) if overrides else {}
+
+        return self._run_test_setup(_compile_test_setup(passage.content), overrides)
+
+    @staticmethod
+    def _run_test_setup(ops: List[Tuple[str, Any]],
+                        overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Run a compiled TestSetup passage (see _compile_test_setup).
 
-            # Process ALL conditionals first (without extracting <<set>> macros yet)
-            # This ensures nested conditionals are evaluated before we extract variables
-            rendered = conditional_content
-            max_iterations = 20
-            for iteration in range(max_iterations):
-                old_rendered = rendered
-                rendered = self._process_conditionals(rendered, processor)
+        Args:
+            ops: Operation list for the passage
+            overrides: Variables applied right after Pass 1
+
+        Returns:
+            Dictionary of test variables
+        """
+        variables: Dict[str, Any] = {}
+        processor = MacroProcessor(variables)
 
-                # If no more changes or no more conditionals, we're done
-                if rendered == old_rendered or '<<if' not in rendered:
-                    break
+        # <<set>> statements found in live spans, not yet run
+        live_sets: List[str] = []
+        seen_if = False
+        # One [enclosing block live, branch already taken] entry per open <<if>>
+        open_ifs: List[List[bool]] = []
+        live = True
+
+        for kind, arg in ops:
+            if kind == 'set':
+                if live:
+                    live_sets.extend(arg)
+            elif kind == 'if':
+                if not seen_if:
+                    # PASS 1: Run top-level <<set>> statements (before first
+                    # <<if>>); later ones wait so every condition sees only these
+                    for macro in live_sets:
+                        processor.process_set_macro(macro)
+                    live_sets = []
+                    seen_if = True
+                    if overrides:
+                        variables.update(overrides)
+                # PASS 2: Decide each branch as it is reached; conditions
+                # inside dead branches are never evaluated
+                taken = live and processor.evaluate_condition(arg)
+                open_ifs.append([live, taken])
+                live = taken
+            elif not open_ifs:
+                # Stray <<elseif>>/<<else>>/<<endif>>
+                continue
+            elif kind == 'elseif':
+                outer, taken = open_ifs[-1]
+                live = outer and not taken and processor.evaluate_condition(arg)
+                open_ifs[-1][1] = taken or live
+            elif kind == 'else':
+                outer, taken = open_ifs[-1]
+                live = outer and not taken
+                open_ifs[-1][1] = True
+            else:
+                live = open_ifs.pop()[0]
 
-            # PASS 3: Now extract all <<set>> statements from fully evaluated content
-            # All conditionals have been resolved, so only active branch <<set>> remain
-            for match in set_pattern.finditer(rendered):
-                macro_content = match.group(1)
-                processor.process_set_macro(macro_content)
+        # PASS 3: Run the <<set>> statements from the branches taken (or,
+        # with no <<if>> at all, every statement as Pass 1)
+        for macro in live_sets:
+            processor.process_set_macro(macro)
+        if overrides and not seen_if:
+            variables.update(overrides)
 
         return variables
 
@@ -717,23 +1694,9 @@ class TweeParser:
             passage: Passage to extract links from
 
         Returns:
-            List of Link objects
+            List of Link objects (copies; the passage's cache is untouched)
         """
-        links = []
-
-        for match in self.LINK_PATTERN.finditer(passage.content):
-            if match.group(2):
-                # [[Display|Target]] format
-                display = match.group(1).strip()
-                target = match.group(2).strip()
-            else:
-                # [[Target]] format
-                target = match.group(1).strip()
-                display = target
-
-            links.append(Link(display=display, target=target))
-
-        return links
+        return _copy_links(passage.links)
 
     def render_passage(self,
                       passage: Passage,
@@ -753,68 +1716,35 @@ class TweeParser:
 
         Returns:
             RenderResult with rendered text, links, and variable changes
+            (the final value of every variable set during the render; these
+            are also written back to variables)
         """
-        errors = []
-        text = passage.content
-        variable_changes = {}
-        processor = MacroProcessor(variables)
+        # Static passage (no macros): the text is the content as written,
+        # so its cached link scan applies and there is nothing to run
+        nodes = self._compiled_passage(passage)
+        if not passage.content or (len(nodes) == 1 and type(nodes[0]) is _TextNode
+                                   and nodes[0].text is passage.content):
+            return RenderResult(
+                text=passage.content.strip(),
+                links=_copy_links(passage.links),
+                variable_changes={},
+                errors=[]
+            )
 
         # Initialize display stack for circular reference detection
         if _display_stack is None:
             _display_stack = []
 
-        # Process <<display>> macros FIRST (before conditionals)
-        # This allows displayed passages to contain conditionals that will be evaluated
-        if passages:
-            text = self._process_display_macros(text, passages, variables, mode, _display_stack, errors)
-
-        # Iteratively process conditionals and <<set>> macros
-        # This handles cases where <<set>> macros affect nested conditionals
-        max_iterations = 20
-        for iteration in range(max_iterations):
-            old_text = text
-
-            # Process <<if>>/<<elseif>>/<<else>>/<<endif>> conditionals
-            text = self._process_conditionals(text, processor)
-
-            # Process <<set>> macros to update variables
-            set_pattern = re.compile(r'<<(set\s+.+?)>>')
-            def replace_set(match):
-                macro_content = match.group(1)
-                processor.process_set_macro(macro_content)
-                return ""  # Remove <<set>> from output
-            text = set_pattern.sub(replace_set, text)
+        # <<set>> writes land in a scratch layer over the caller's variables
+        # (reads fall through), then are applied in one update at the end
+        variable_changes: Dict[str, Any] = {}
+        scope = ChainMap(variable_changes, variables)
 
-            # If no changes were made, we're done
-            if text == old_text:
-                break
-
-        # Process <<print>> macros (after all variables are updated)
-        def replace_print(match):
-            macro_content = match.group(1)
-            return processor.process_print_macro(macro_content)
-
-        print_pattern = re.compile(r'<<(print\s+[^>]+)>>')
-        text = print_pattern.sub(replace_print, text)
-
-        # Process <<nobr>>/<<endnobr>> - remove line breaks
-        nobr_pattern = re.compile(r'<<nobr>>(.*?)<<endnobr>>', re.DOTALL)
-        text = nobr_pattern.sub(lambda m: m.group(1).replace('\n', ' '), text)
+        text, errors = self._render_text(passage, MacroProcessor(scope), mode, passages, _display_stack)
+        variables.update(variable_changes)
 
         # Extract links from processed text (not original passage content)
-        links = []
-        for match in self.LINK_PATTERN.finditer(text):
-            if match.group(2):
-                # [[Display|Target]] format
-                display = match.group(1).strip()
-                target = match.group(2).strip()
-            else:
-                # [[Target]] format
-                target = match.group(1).strip()
-                display = target
-            links.append(Link(display=display, target=target))
-
-        errors.extend(processor.errors)
+        links = _scan_links(text)
 
         return RenderResult(
             text=text.strip(),
@@ -823,159 +1753,67 @@ class TweeParser:
             errors=errors
         )
 
-    def _process_display_macros(self,
-                                 text: str,
-                                 passages: Dict[str, Passage],
-                                 variables: Dict[str, Any],
-                                 mode: ExecutionMode,
-                                 display_stack: List[str],
-                                 errors: List[str]) -> str:
+    def _render_text(self,
+                     passage: Passage,
+                     processor: MacroProcessor,
+                     mode: ExecutionMode,
+                     passages: Optional[Dict[str, Passage]],
+                     display_stack: List[str],
+                     lower_names: Optional[Dict[str, str]] = None) -> Tuple[str, List[str]]:
         """
-        Process <<display "PASSAGE_NAME">> macros by including passage content inline.
+        Render a passage's compiled tree to text.
+
+        Shared by render_passage and <<display>>; nested displays only need
+        the text, so they skip the link scan and RenderResult, and reuse
+        the displaying passage's processor (same variables, and its
+        evaluator's lookup index stays warm).
 
         Args:
-            text: Text containing <<display>> macros
-            passages: Dict of all passages
-            variables: Variable store
+            passage: Passage to render
+            processor: Macro processor over the variable store
             mode: Execution mode
-            display_stack: Stack of currently displayed passages (for circular reference detection)
-            errors: Error list to append to
+            passages: Dict of all passages (needed for <<display>> macro)
+            display_stack: Passages currently being displayed
+            lower_names: Case-insensitive passage name index shared by
+                this render's nested displays (built on demand)
 
         Returns:
-            Text with <<display>> macros replaced by passage content
-        """
-        # Pattern: <<display "PASSAGE_NAME">> or <<display 'PASSAGE_NAME'>>
-        display_pattern = re.compile(r'<<display\s+["\']([^"\']+)["\']\s*>>', re.IGNORECASE)
-
-        def replace_display(match):
-            passage_name = match.group(1).strip()
-
-            # Check for circular reference
-            if passage_name in display_stack:
-                error_msg = f"Circular <<display>> reference detected: {' -> '.join(display_stack + [passage_name])}"
-                errors.append(error_msg)
-                return f"[ERROR: {error_msg}]"
-
-            # Look up passage (case-insensitive)
-            target_passage = None
-            for name, passage in passages.items():
-                if name.lower() == passage_name.lower():
-                    target_passage = passage
-                    break
-
-            if not target_passage:
-                error_msg = f"<<display>> passage not found: {passage_name}"
-                errors.append(error_msg)
-                return f"[ERROR: {error_msg}]"
-
-            # Add to display stack
-            new_display_stack = display_stack + [passage_name]
-
-            # Recursively render the displayed passage
-            # This allows displayed passages to have their own macros, conditionals, etc.
-            result = self.render_passage(
-                target_passage,
-                variables,
-                mode,
-                passages,
-                new_display_stack
-            )
-
-            # Collect any errors from the nested render
-            errors.extend(result.errors)
-
-            # Return the rendered text
-            return result.text
-
-        # Replace all <<display>> macros
-        return display_pattern.sub(replace_display, text)
-
-    def _process_conditionals(self, text: str, processor: MacroProcessor) -> str:
+            (text, errors) tuple; text is not stripped
+        """
+        errors: List[str] = []
+        first_error = len(processor.errors)
+
+        # Walk the passage's compiled node tree into one parts list; each
+        # <<print>> sees the variables as set by the macros before it
+        if lower_names is None:
+            lower_names = {}
+        state = _RenderState(self, processor, mode, passages, display_stack, errors, lower_names)
+        for node in self._compiled_passage(passage):
+            node.render(state)
+
+        # Macro errors raised by this passage go after its own errors
+        errors.extend(processor.errors[first_error:])
+        del processor.errors[first_error:]
+        return ''.join(state.parts), errors
+
+    @staticmethod
+    def _compiled_passage(passage: Passage) -> List[_Node]:
         """
-        Process <<if>>/<<elseif>>/<<else>>/<<endif>> blocks.
-        Only processes the FIRST/OUTERMOST conditional block found.
-        Caller should loop to process nested conditionals after updating variables.
+        Get the passage's compiled node tree, compiling on first use.
+
+        The tree is cached on the passage until its content is reassigned.
 
         Args:
-            text: Passage text with conditionals
-            processor: Macro processor for evaluating conditions
+            passage: Passage to compile
 
         Returns:
-            Text with first conditional evaluated
-        """
-        # Only process ONE <<if>> block, not all of them
-        # This allows the caller to process <<set>> macros between nested conditionals
-
-        # Match everything except >> at the end (use negative lookahead to avoid matching single >)
-        if_match = re.search(r'<<if\s+((?:(?!>>).)+)>>', text, re.DOTALL)
-        if not if_match:
-            return text
-
-        # Find matching <<endif>>
-        start_pos = if_match.end()
-        depth = 1
-        pos = start_pos
-        sections = []  # [(type, condition, content), ...]
-        current_section_type = 'if'
-        current_condition = if_match.group(1)
-        current_content_start = start_pos
-
-        while pos < len(text) and depth > 0:
-            # Look for next control structure
-            # Match everything except >> at the end (use negative lookahead)
-            # Support both <<endif>> and <</if>> syntaxes
-            next_match = re.search(r'<<(/?)(if|elseif|else|endif)(?:\s+((?:(?!>>).)+))?>>',text[pos:], re.DOTALL)
-            if not next_match:
-                break
-
-            is_closing = next_match.group(1) == '/'
-            match_type = next_match.group(2)
-            # Convert closing tags to 'endif' for unified handling
-            if is_closing and match_type == 'if':
-                match_type = 'endif'
-            match_pos = pos + next_match.start()
-
-            if match_type == 'if':
-                depth += 1
-                pos = pos + next_match.end()
-            elif match_type == 'endif':
-                depth -= 1
-                if depth == 0:
-                    # Save current section
-                    content = text[current_content_start:match_pos]
-                    sections.append((current_section_type, current_condition, content))
-                    # Found matching endif
-                    endif_pos = pos + next_match.end()
-
-                    # Evaluate sections
-                    result_text = ""
-                    for section_type, condition, content in sections:
-                        if section_type == 'else':
-                            result_text = content
-                            break
-                        elif processor.evaluate_condition(condition):
-                            result_text = content
-                            break
-
-                    # Replace entire if block with result
-                    text = text[:if_match.start()] + result_text + text[endif_pos:]
-                    return text
-                else:
-                    pos = pos + next_match.end()
-            elif match_type in ('elseif', 'else') and depth == 1:
-                # Save current section
-                content = text[current_content_start:match_pos]
-                sections.append((current_section_type, current_condition, content))
-
-                # Start new section
-                current_section_type = match_type
-                current_condition = next_match.group(3) if match_type == 'elseif' else None
-                current_content_start = pos + next_match.end()
-                pos = pos + next_match.end()
-            else:
-                pos = pos + next_match.end()
-
-        return text
+            Top-level node list
+        """
+        cached = passage._compiled
+        if cached is None or cached[0] is not passage.content:
+            cached = (passage.content, _compile_passage(passage.content))
+            passage._compiled = cached
+        return cached[1]
 
 
 # ============================================================================
@@ -8,129 +8,392 @@ Usage:
     # Parse a twee file
     python3 tw1x_cli.py parse story.twee
 
+    # Parse twee source piped on stdin
+    cat story.twee | python3 tw1x_cli.py parse -
+
     # Render a passage with variables (from stdin)
     echo '{"HEALTH": 100}' | python3 tw1x_cli.py render story.twee Start
 
     # Evaluate an expression
     echo '{"HEALTH": 100}' | python3 tw1x_cli.py evaluate '$HEALTH + 50'
 
+    # Indent the JSON output for reading
+    python3 tw1x_cli.py --pretty info story.twee
+
+    # Reuse parses of unchanged files across runs (per-user cache dir)
+    python3 tw1x_cli.py --cache info story.twee
+
 Author: Development Team
 Version: 0.4.0 (Phase 4: CLI Interface)
 Date: 2025-10-25
 """
 
 import sys
+import os
 import json
 import argparse
-from typing import Dict, Any, Optional
+import functools
+import hashlib
+import pickle
+from typing import Dict, Any, IO, List, Optional
 from pathlib import Path
 
 from tw1x import (
-    parse_twee, TweeParser, ExpressionEvaluator,
-    VariableScope, ExecutionMode
+    parse_twee, TweeParser, ExpressionEvaluator, Passage, ParseResult,
+    VariableScope, ExecutionMode, __version__
 )
 
 
-def read_stdin_json() -> Dict[str, Any]:
+# Shared encoder: output is plain dicts/lists (via to_dict()), so the
+# circular-reference check is unnecessary and compact separators suffice.
+# Output stays ASCII (non-ASCII text is \u-escaped) so it can be written to
+# any stdout encoding
+_ENCODER = json.JSONEncoder(check_circular=False, separators=(',', ':'))
+
+# Indented output for people reading it (--pretty)
+_PRETTY_ENCODER = json.JSONEncoder(check_circular=False, indent=2)
+
+
+def _encoder(args: argparse.Namespace) -> json.JSONEncoder:
+    """
+    Get the JSON encoder chosen for a command.
+
+    Args:
+        args: Command arguments; main() sets 'encoder', while callers
+            building their own Namespace may leave it out
+
+    Returns:
+        args.encoder, or the compact encoder if it is not set
+    """
+    return getattr(args, 'encoder', _ENCODER)
+
+
+def read_stdin_json(stdin: IO[str]) -> Optional[Dict[str, Any]]:
     """
     Read JSON from stdin.
 
+    Args:
+        stdin: Stream to read variables from
+
     Returns:
-        Dictionary of variables or empty dict if no input
+        Dictionary of variables, empty dict if no input, or None if the
+        input is not valid JSON (the error is reported on stderr)
     """
-    if not sys.stdin.isatty():
+    if not stdin.isatty():
         try:
-            data = sys.stdin.read().strip()
+            data = stdin.read().strip()
             if data:
                 return json.loads(data)
         except json.JSONDecodeError as e:
-            print(json.dumps({
+            print(_ENCODER.encode({
                 "error": f"Invalid JSON on stdin: {str(e)}"
             }), file=sys.stderr)
-            sys.exit(1)
+            return None
     return {}
 
 
-def cmd_parse(args: argparse.Namespace) -> None:
+# Bumped whenever the pickled layout changes; stored in every cache key
+# together with the tw1x version so upgrades never see older parses
+_CACHE_FORMAT = 1
+
+
+def default_cache_dir() -> str:
     """
-    Parse a twee file and output story structure as JSON.
+    Get the per-user directory for the on-disk parse cache.
+
+    Returns:
+        $TW1X_CACHE_DIR if set, else $XDG_CACHE_HOME/tw1x, else
+        ~/.cache/tw1x
+    """
+    cache_dir = os.environ.get('TW1X_CACHE_DIR')
+    if cache_dir:
+        return cache_dir
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'tw1x')
+
+
+def _cache_key(path: str, mtime_ns: int, size: int) -> bytes:
+    """
+    Build the header line identifying a cached parse.
 
     Args:
-        args: Command arguments with 'file' attribute
+        path: Absolute path to the twee file
+        mtime_ns: File modification time in nanoseconds
+        size: File size in bytes
+
+    Returns:
+        One JSON-encoded line, newline included
+    """
+    key = [_CACHE_FORMAT, __version__, path, mtime_ns, size]
+    return (json.dumps(key) + '\n').encode('utf-8')
+
+
+def _pickle_path(cache_dir: str, path: str) -> str:
     """
+    Get the cache file location for a twee file.
+
+    Args:
+        cache_dir: Per-user cache directory
+        path: Absolute path to the twee file
+
+    Returns:
+        Path of the pickle, named after a hash of the story path
+    """
+    digest = hashlib.sha256(path.encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(cache_dir, digest + '.pkl')
+
+
+def _is_private(cache_path: str) -> bool:
+    """
+    Check that a cache file was written by this user and nobody else can.
+
+    Args:
+        cache_path: Path of the cache file
+
+    Returns:
+        True if the file is safe to unpickle
+    """
+    stat = os.stat(cache_path)
+    if hasattr(os, 'getuid') and stat.st_uid != os.getuid():
+        return False
+    return not stat.st_mode & 0o022
+
+
+def _load_pickled_story(cache_dir: str, path: str, mtime_ns: int, size: int) -> Optional[ParseResult]:
+    """
+    Load a parse cached on disk by an earlier process.
+
+    The key line is compared before anything is unpickled, and files not
+    owned by the current user (or writable by others) are never loaded.
+
+    Args:
+        cache_dir: Per-user cache directory
+        path: Absolute path to the twee file
+        mtime_ns: Current file modification time in nanoseconds
+        size: Current file size in bytes
+
+    Returns:
+        The cached ParseResult, or None if there is no usable cache for
+        this version of the file (and of tw1x)
+    """
+    cache_path = _pickle_path(cache_dir, path)
     try:
-        # Read file
-        file_path = Path(args.file)
-        if not file_path.exists():
-            print(json.dumps({
-                "error": f"File not found: {args.file}"
-            }))
-            sys.exit(1)
+        if not _is_private(cache_path):
+            return None
+        with open(cache_path, 'rb') as f:
+            if f.readline() != _cache_key(path, mtime_ns, size):
+                return None
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def _store_pickled_story(cache_dir: str, path: str, mtime_ns: int, size: int,
+                         result: ParseResult) -> None:
+    """
+    Write a parse to the cache directory for later processes.
+
+    Failures (unwritable directory, unpicklable content) are ignored: the
+    cache is only an optimization.
+
+    Args:
+        cache_dir: Per-user cache directory
+        path: Absolute path to the twee file
+        mtime_ns: File modification time the parse was made from
+        size: File size the parse was made from
+        result: Parse to store
+    """
+    cache_path = _pickle_path(cache_dir, path)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_cache_key(path, mtime_ns, size))
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+@functools.lru_cache(maxsize=32)
+def _parse_story_file(path: str, mtime_ns: int, size: int,
+                      cache_dir: Optional[str] = None) -> ParseResult:
+    """
+    Parse a twee file, memoized on its path and stat signature.
+
+    mtime_ns and size are only part of the cache key: an edited file gets a
+    new key and is parsed again. With a cache_dir (the --cache flag), parses
+    are also pickled there so short-lived CLI processes can skip parsing an
+    unchanged file altogether.
 
-        with open(file_path, 'r') as f:
-            content = f.read()
+    Args:
+        path: Absolute path to the twee file
+        mtime_ns: File modification time in nanoseconds
+        size: File size in bytes
+        cache_dir: Per-user cache directory, or None to keep the parse in
+            this process only
+
+    Returns:
+        ParseResult shared between callers (load_story hands out copies)
+    """
+    result = None
+    if cache_dir is not None:
+        result = _load_pickled_story(cache_dir, path, mtime_ns, size)
+    if result is None:
+        result = TweeParser().parse_twee_file(path)
+        if cache_dir is not None:
+            _store_pickled_story(cache_dir, path, mtime_ns, size, result)
+    return result
+
+
+def _copy_result(result: ParseResult) -> ParseResult:
+    """
+    Copy a cached ParseResult so callers can mutate it freely.
+
+    Strings are immutable and shared; passages, tags, variables and errors
+    are fresh. Each passage keeps its compiled render nodes (internal and
+    never mutated) but rescans its links on first access.
+
+    Args:
+        result: Cached parse to copy
+
+    Returns:
+        ParseResult sharing no mutable state with result
+    """
+    passages: Dict[str, Passage] = {}
+    for name, passage in result.passages.items():
+        fresh = Passage(
+            name=passage.name,
+            tags=list(passage.tags),
+            content=passage.content,
+            raw_content=passage.raw_content,
+            image_url=passage.image_url
+        )
+        fresh._compiled = passage._compiled
+        passages[name] = fresh
+    return ParseResult(
+        passages=passages,
+        story_init_vars=dict(result.story_init_vars),
+        test_setup_vars=dict(result.test_setup_vars),
+        errors=list(result.errors)
+    )
+
+
+def load_story(args: argparse.Namespace, stdin: IO[str], stdout: IO[str]) -> Optional[ParseResult]:
+    """
+    Read and parse the twee file named by args.file.
+
+    If args.preparsed already holds a result for that path it is returned
+    without touching the file. A file of '-' parses the twee source on
+    stdin (parse and info only; render needs stdin for its variables). Otherwise the parse is cached in process (and, with
+    args.cache_dir set, on disk) until the file's mtime or size changes,
+    and each call gets its own copy of it.
+
+    Args:
+        args: Command arguments with 'file' and 'preparsed' (and
+            optionally 'encoder' and 'cache_dir') attributes
+        stdin: Stream to read twee source from when args.file is '-'
+        stdout: Stream to write the error to if the file is missing
+
+    Returns:
+        ParseResult, or None if the file does not exist
+    """
+    preparsed = getattr(args, 'preparsed', None)
+    if preparsed and args.file in preparsed:
+        return preparsed[args.file]
+
+    if args.file == '-':
+        return parse_twee(stdin.read())
 
-        # Parse
-        result = parse_twee(content)
+    file_path = Path(args.file)
+    if not file_path.exists():
+        print(_encoder(args).encode({
+            "error": f"File not found: {args.file}"
+        }), file=stdout)
+        return None
+
+    stat = file_path.stat()
+    return _copy_result(_parse_story_file(os.path.abspath(file_path), stat.st_mtime_ns,
+                                          stat.st_size, getattr(args, 'cache_dir', None)))
+
+
+def cmd_parse(args: argparse.Namespace, stdin: IO[str], stdout: IO[str]) -> int:
+    """
+    Parse a twee file and output story structure as JSON.
+
+    Args:
+        args: Command arguments with 'file' (and optionally 'encoder') attributes
+        stdin: Stream to read variables from
+        stdout: Stream to write JSON output to
+
+    Returns:
+        Process exit code
+    """
+    encoder = _encoder(args)
+    try:
+        # Read and parse file
+        result = load_story(args, stdin, stdout)
+        if result is None:
+            return 1
 
         # Convert to JSON-serializable format
-        output = {
-            "passages": {
-                name: {
-                    "name": p.name,
-                    "tags": p.tags,
-                    "content": p.content,
-                    "image_url": p.image_url
-                }
-                for name, p in result.passages.items()
-            },
-            "story_init_vars": result.story_init_vars,
-            "test_setup_vars": result.test_setup_vars,
-            "errors": result.errors,
-            "passage_count": len(result.passages)
-        }
+        output = result.to_dict()
+        output["passage_count"] = len(result.passages)
 
-        print(json.dumps(output, indent=2))
+        print(encoder.encode(output), file=stdout)
+        return 0
 
     except Exception as e:
-        print(json.dumps({
+        print(encoder.encode({
             "error": f"Parse error: {str(e)}"
-        }))
-        sys.exit(1)
+        }), file=stdout)
+        return 1
 
 
-def cmd_render(args: argparse.Namespace) -> None:
+def cmd_render(args: argparse.Namespace, stdin: IO[str], stdout: IO[str]) -> int:
     """
     Render a passage with variables from stdin.
 
     Args:
-        args: Command arguments with 'file' and 'passage' attributes
+        args: Command arguments with 'file' and 'passage' (and optionally
+            'encoder') attributes
+        stdin: Stream to read variables from
+        stdout: Stream to write JSON output to
+
+    Returns:
+        Process exit code
     """
+    encoder = _encoder(args)
     try:
-        # Read variables from stdin
-        variables = read_stdin_json()
+        # Stdin carries the variables, so it cannot also carry the story
+        if args.file == '-':
+            print(encoder.encode({
+                "error": "render reads variables from stdin; "
+                         "pass the story as a file path, not '-'"
+            }), file=stdout)
+            return 1
 
-        # Read file
-        file_path = Path(args.file)
-        if not file_path.exists():
-            print(json.dumps({
-                "error": f"File not found: {args.file}"
-            }))
-            sys.exit(1)
-
-        with open(file_path, 'r') as f:
-            content = f.read()
+        # Read variables from stdin
+        variables = read_stdin_json(stdin)
+        if variables is None:
+            return 1
 
-        # Parse
-        result = parse_twee(content)
+        # Read and parse file
+        result = load_story(args, stdin, stdout)
+        if result is None:
+            return 1
 
         # Find passage
-        if args.passage not in result.passages:
-            print(json.dumps({
+        if args.passage not in result.passage_names:
+            print(encoder.encode({
                 "error": f"Passage not found: {args.passage}",
                 "available_passages": list(result.passages.keys())
-            }))
-            sys.exit(1)
+            }), file=stdout)
+            return 1
 
         passage = result.passages[args.passage]
 
@@ -139,39 +402,37 @@ def cmd_render(args: argparse.Namespace) -> None:
         render_result = parser.render_passage(passage, variables, passages=result.passages)
 
         # Convert to JSON
-        output = {
-            "text": render_result.text,
-            "links": [
-                {
-                    "display": link.display,
-                    "target": link.target,
-                    "setters": link.setters
-                }
-                for link in render_result.links
-            ],
-            "variable_changes": render_result.variable_changes,
-            "errors": render_result.errors
-        }
+        output = render_result.to_dict()
 
-        print(json.dumps(output, indent=2))
+        print(encoder.encode(output), file=stdout)
+        return 0
 
     except Exception as e:
-        print(json.dumps({
+        print(encoder.encode({
             "error": f"Render error: {str(e)}"
-        }))
-        sys.exit(1)
+        }), file=stdout)
+        return 1
 
 
-def cmd_evaluate(args: argparse.Namespace) -> None:
+def cmd_evaluate(args: argparse.Namespace, stdin: IO[str], stdout: IO[str]) -> int:
     """
     Evaluate an expression with variables from stdin.
 
     Args:
-        args: Command arguments with 'expression' attribute
+        args: Command arguments with 'expression' (and optionally 'encoder')
+            attributes
+        stdin: Stream to read variables from
+        stdout: Stream to write JSON output to
+
+    Returns:
+        Process exit code
     """
+    encoder = _encoder(args)
     try:
         # Read variables from stdin
-        variables = read_stdin_json()
+        variables = read_stdin_json(stdin)
+        if variables is None:
+            return 1
 
         # Evaluate expression
         evaluator = ExpressionEvaluator(variables)
@@ -184,36 +445,34 @@ def cmd_evaluate(args: argparse.Namespace) -> None:
             "errors": evaluator.errors
         }
 
-        print(json.dumps(output, indent=2))
+        print(encoder.encode(output), file=stdout)
+        return 0
 
     except Exception as e:
-        print(json.dumps({
+        print(encoder.encode({
             "error": f"Evaluation error: {str(e)}"
-        }))
-        sys.exit(1)
+        }), file=stdout)
+        return 1
 
 
-def cmd_info(args: argparse.Namespace) -> None:
+def cmd_info(args: argparse.Namespace, stdin: IO[str], stdout: IO[str]) -> int:
     """
     Get story metadata (title, init vars, test vars).
 
     Args:
-        args: Command arguments with 'file' attribute
+        args: Command arguments with 'file' (and optionally 'encoder') attributes
+        stdin: Stream to read variables from
+        stdout: Stream to write JSON output to
+
+    Returns:
+        Process exit code
     """
+    encoder = _encoder(args)
     try:
-        # Read file
-        file_path = Path(args.file)
-        if not file_path.exists():
-            print(json.dumps({
-                "error": f"File not found: {args.file}"
-            }))
-            sys.exit(1)
-
-        with open(file_path, 'r') as f:
-            content = f.read()
-
-        # Parse
-        result = parse_twee(content)
+        # Read and parse file
+        result = load_story(args, stdin, stdout)
+        if result is None:
+            return 1
 
         # Get title
         title = result.passages.get('StoryTitle')
@@ -229,17 +488,40 @@ def cmd_info(args: argparse.Namespace) -> None:
             "errors": result.errors
         }
 
-        print(json.dumps(output, indent=2))
+        print(encoder.encode(output), file=stdout)
+        return 0
 
     except Exception as e:
-        print(json.dumps({
+        print(encoder.encode({
             "error": f"Info error: {str(e)}"
-        }))
-        sys.exit(1)
+        }), file=stdout)
+        return 1
 
 
-def main():
-    """Main CLI entry point."""
+def main(
+    argv: Optional[List[str]] = None,
+    stdin: Optional[IO[str]] = None,
+    stdout: Optional[IO[str]] = None,
+    preparsed: Optional[Dict[str, ParseResult]] = None
+) -> int:
+    """
+    Main CLI entry point.
+
+    Args:
+        argv: Command-line arguments (defaults to sys.argv[1:])
+        stdin: Stream to read variables from (defaults to sys.stdin)
+        stdout: Stream to write JSON output to (defaults to sys.stdout)
+        preparsed: Already parsed stories keyed by file path; matching
+            files are not read or parsed again
+
+    Returns:
+        Process exit code
+    """
+    if stdin is None:
+        stdin = sys.stdin
+    if stdout is None:
+        stdout = sys.stdout
+
     parser = argparse.ArgumentParser(
         description='TW1X - Twee 1.0 Parser CLI',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -248,6 +530,9 @@ Examples:
   # Parse a story file
   python3 tw1x_cli.py parse story.twee
 
+  # Parse a story piped on stdin
+  cat story.twee | python3 tw1x_cli.py parse -
+
   # Get story metadata
   python3 tw1x_cli.py info story.twee
 
@@ -257,19 +542,31 @@ Examples:
   # Evaluate an expression
   echo '{"HEALTH": 100}' | python3 tw1x_cli.py evaluate '$HEALTH + 50'
 
+  # Indent the JSON output for reading
+  python3 tw1x_cli.py --pretty info story.twee
+
+  # Reuse parses of unchanged files across runs
+  python3 tw1x_cli.py --cache render story.twee Start
+
 Variables are passed via stdin as JSON.
         """
     )
 
+    parser.add_argument('--pretty', action='store_true',
+                        help='Indent JSON output (default is compact)')
+    parser.add_argument('--cache', action='store_true',
+                        help='Keep parses in a per-user cache directory '
+                             '($TW1X_CACHE_DIR or ~/.cache/tw1x) between runs')
+
     subparsers = parser.add_subparsers(dest='command', help='Commands')
 
     # Parse command
     parse_parser = subparsers.add_parser('parse', help='Parse a twee file')
-    parse_parser.add_argument('file', help='Twee file to parse')
+    parse_parser.add_argument('file', help='Twee file to parse ("-" for stdin)')
 
     # Render command
     render_parser = subparsers.add_parser('render', help='Render a passage')
-    render_parser.add_argument('file', help='Twee file')
+    render_parser.add_argument('file', help='Twee file (not "-": stdin holds the variables)')
     render_parser.add_argument('passage', help='Passage name to render')
 
     # Evaluate command
@@ -278,23 +575,26 @@ Variables are passed via stdin as JSON.
 
     # Info command
     info_parser = subparsers.add_parser('info', help='Get story metadata')
-    info_parser.add_argument('file', help='Twee file')
+    info_parser.add_argument('file', help='Twee file ("-" for stdin)')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    args.preparsed = preparsed
+    args.encoder = _PRETTY_ENCODER if args.pretty else _ENCODER
+    args.cache_dir = default_cache_dir() if args.cache else None
 
     # Execute command
     if args.command == 'parse':
-        cmd_parse(args)
+        return cmd_parse(args, stdin, stdout)
     elif args.command == 'render':
-        cmd_render(args)
+        return cmd_render(args, stdin, stdout)
     elif args.command == 'evaluate':
-        cmd_evaluate(args)
+        return cmd_evaluate(args, stdin, stdout)
     elif args.command == 'info':
-        cmd_info(args)
+        return cmd_info(args, stdin, stdout)
     else:
         parser.print_help()
-        sys.exit(1)
+        return 1
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())